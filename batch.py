@@ -0,0 +1,304 @@
+# The batch.py compares many query pairs without the GUI and writes the results to a directory
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import render
+from explain import Control
+from options import add_connection_arguments, add_control_arguments, get_control_options
+
+
+# read query pairs from a JSONL file, one {"id": ..., "query1": ..., "query2": ...} per line
+# a line that is not such an object is logged with its line number and skipped
+def read_jsonl_pairs(path: str):
+    with open(path) as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                pair = json.loads(line)
+                yield str(pair.get("id", line_no)), pair["query1"], pair["query2"]
+            except json.JSONDecodeError as e:
+                logging.error(f"{path}:{line_no}: skipped, not valid JSON: {e}")
+            except (KeyError, AttributeError):
+                logging.error(f"{path}:{line_no}: skipped, expected an object with query1 and query2")
+
+
+# read query pairs from a directory of NAME.1.sql and NAME.2.sql files
+def read_sql_pairs(directory: str):
+    for path1 in sorted(glob.glob(os.path.join(directory, "*.1.sql"))):
+        name = os.path.basename(path1)[: -len(".1.sql")]
+        path2 = os.path.join(directory, name + ".2.sql")
+        if not os.path.isfile(path2):
+            logging.warning(f"skipping {name}: {path2} not found")
+            continue
+        with open(path1) as f1, open(path2) as f2:
+            yield name, f1.read(), f2.read()
+
+
+# read pairs of saved plans from a directory of NAME.1.json and NAME.2.json files, for --plan-dir
+# the queries are the paths of the files, which the plan source reads
+def read_plan_pairs(directory: str):
+    for path1 in sorted(glob.glob(os.path.join(directory, "*.1.json"))):
+        name = os.path.basename(path1)[: -len(".1.json")]
+        path2 = os.path.join(directory, name + ".2.json")
+        if not os.path.isfile(path2):
+            logging.warning(f"skipping {name}: {path2} not found")
+            continue
+        yield name, os.path.abspath(path1), os.path.abspath(path2)
+
+
+# pairs are read lazily so large inputs are never held in memory
+def read_pairs(path: str, plans: bool = False):
+    if os.path.isdir(path):
+        return read_plan_pairs(path) if plans else read_sql_pairs(path)
+    return read_jsonl_pairs(path)
+
+
+# turn a pair id into something usable as a directory name
+def get_safe_name(pair_id: str) -> str:
+    return re.sub(r"[^\w.-]", "_", pair_id)
+
+
+# compare one pair and return a JSON serializable result, errors are recorded instead of raised
+def compare_pair(
+    control: Control, pair_id: str, query1: str, query2: str, output_dir: str, images: bool
+) -> dict:
+    result = {"id": pair_id, "query1": query1, "query2": query2}
+    image_paths = None
+    if images:
+        pair_dir = os.path.join(output_dir, get_safe_name(pair_id))
+        os.makedirs(pair_dir, exist_ok=True)
+        image_paths = (
+            os.path.join(pair_dir, "tree1.png"),
+            os.path.join(pair_dir, "tree2.png"),
+        )
+    # with tracing on, the time of each stage is kept with the result
+    def add_trace(trace) -> None:
+        result["trace"] = trace.to_dict()
+
+    start = time.perf_counter()
+    try:
+        (
+            formatted_q1,
+            formatted_q2,
+            tree1_explanation,
+            tree2_explanation,
+            tree_diff_statement,
+            query_diff_strs,
+            query_diff_colors,
+        ) = control.generate_differences(
+            query1, query2, image_paths=image_paths, trace_ready=add_trace
+        )
+    except Exception as e:
+        result["error"] = e.__class__.__name__ + ": " + str(e).strip()
+    else:
+        result.update(
+            {
+                "formatted_query1": formatted_q1,
+                "formatted_query2": formatted_q2,
+                "explanation1": tree1_explanation,
+                "explanation2": tree2_explanation,
+                "qep_difference": tree_diff_statement,
+                "query_difference": query_diff_strs,
+                "query_difference_colors": query_diff_colors,
+            }
+        )
+        if image_paths is not None:
+            result["images"] = [os.path.relpath(p, output_dir) for p in image_paths]
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+# compare the pairs one after another in this process
+def iter_results(control: Control, pairs, output_dir: str, images: bool):
+    for pair_id, query1, query2 in pairs:
+        yield compare_pair(control, pair_id, query1, query2, output_dir, images)
+
+
+# the Control of a worker process, each worker has its own DB connections
+worker_control = None
+
+
+def init_worker(control_args: tuple, control_options: dict) -> None:
+    global worker_control
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler()],
+    )
+    worker_control = Control(*control_args, **control_options)
+    # the pairs are already spread over processes, so each worker draws its own trees,
+    # a process pool inside a pool worker would also keep it from exiting
+    render.render_workers = 0
+
+
+def compare_pair_in_worker(
+    pair_id: str, query1: str, query2: str, output_dir: str, images: bool
+) -> dict:
+    return compare_pair(worker_control, pair_id, query1, query2, output_dir, images)
+
+
+# the result of a pair whose worker process died, e.g. killed for running out of memory
+def get_lost_result(pair_id: str, query1: str, query2: str) -> dict:
+    return {
+        "id": pair_id,
+        "query1": query1,
+        "query2": query2,
+        "error": "BrokenProcessPool: the worker process stopped while comparing this pair",
+    }
+
+
+def start_workers(control_args: tuple, control_options: dict, workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(control_args, control_options),
+    )
+
+
+# compare the pairs on a pool of worker processes
+# at most max_in_flight pairs are submitted or waiting to be written at any time,
+# results come out in input order when ordered is set, otherwise as they complete
+# when a worker dies every pair still in flight is recorded as failed and a new pool takes the rest
+def iter_results_parallel(
+    control_args: tuple,
+    control_options: dict,
+    pairs,
+    output_dir: str,
+    images: bool,
+    workers: int,
+    ordered: bool = False,
+    max_in_flight: int = None,
+):
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+    pairs = enumerate(pairs)
+    in_flight = {}  # future -> (input index, pair id, query1, query2)
+    finished = {}  # input index -> result, only used when ordered
+    next_index = 0
+    exhausted = False
+    executor = start_workers(control_args, control_options, workers)
+    try:
+        while True:
+            while not exhausted and len(in_flight) + len(finished) < max_in_flight:
+                try:
+                    index, (pair_id, query1, query2) = next(pairs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = executor.submit(
+                    compare_pair_in_worker, pair_id, query1, query2, output_dir, images
+                )
+                in_flight[future] = (index, pair_id, query1, query2)
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                index, pair_id, query1, query2 = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    result = get_lost_result(pair_id, query1, query2)
+                if not ordered:
+                    yield result
+                    continue
+                finished[index] = result
+            if broken:
+                # the pairs that were still running or queued are lost with the pool
+                logging.error("a worker process stopped, restarting the workers")
+                for index, pair_id, query1, query2 in in_flight.values():
+                    finished[index] = get_lost_result(pair_id, query1, query2)
+                in_flight.clear()
+                if not ordered:
+                    yield from finished.values()
+                    finished.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = start_workers(control_args, control_options, workers)
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def write_results(results, output_dir: str) -> tuple[int, int]:
+    # results are appended to results.jsonl as soon as each pair is done
+    succeeded = failed = 0
+    with open(os.path.join(output_dir, "results.jsonl"), "w") as out:
+        for result in results:
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            if "error" in result:
+                failed += 1
+                logging.error(f"{result['id']}: {result['error']}")
+            else:
+                succeeded += 1
+                logging.info(f"{result['id']}: done in {result['seconds']}s")
+    return succeeded, failed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler()],
+    )
+    parser = argparse.ArgumentParser(
+        description="Compare query pairs without the GUI."
+    )
+    add_connection_arguments(parser)
+    add_control_arguments(parser)
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="JSONL file of {id, query1, query2} or a directory of NAME.1.sql/NAME.2.sql files, "
+        "with --plan-dir the queries are plan files and the directory has NAME.1.json/NAME.2.json files",
+    )
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--images", action="store_true", help="also draw the QEP trees")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes, 0 for one per CPU core",
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        help="write results in input order instead of as they complete",
+    )
+    args = parser.parse_args()
+    control_args = (args.host, args.port, args.database, args.user, args.password)
+    control_options = get_control_options(parser, args)
+    workers = args.workers or os.cpu_count()
+    os.makedirs(args.output, exist_ok=True)
+    pairs = read_pairs(args.input, plans=args.plan_dir is not None)
+    if workers > 1:
+        results = iter_results_parallel(
+            control_args,
+            control_options,
+            pairs,
+            args.output,
+            args.images,
+            workers,
+            ordered=args.ordered,
+        )
+    else:
+        control = Control(*control_args, **control_options)
+        results = iter_results(control, pairs, args.output, args.images)
+    succeeded, failed = write_results(results, args.output)
+    logging.info(f"{succeeded} pairs compared, {failed} failed")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1 @@
+# The benchmark package contains measurements of the comparison pipeline that run without a database
@@ -0,0 +1,45 @@
+# The draw_memory.py measures the memory draw_tree needs to prepare both trees for the renderer,
+# against the deep copies of the trees it used to make first
+# usage: python -m benchmark.draw_memory [--nodes 1000 10000]
+import argparse
+import copy
+import time
+import tracemalloc
+
+from benchmark.plans import PlanGenerator
+from explain import get_same_pattern, get_tree, get_tree_layout
+
+
+# peak traced memory and seconds of preparing both trees, the trees themselves are not counted
+def measure(tree1, tree2, deep_copy: bool) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    if deep_copy:
+        tree1, tree2 = copy.deepcopy(tree1), copy.deepcopy(tree2)
+    layouts = [get_tree_layout(tree1), get_tree_layout(tree2)]
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del layouts
+    return peak, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the memory draw_tree needs before the trees are rendered."
+    )
+    parser.add_argument("--nodes", type=int, nargs="+", default=[100, 1000, 10000])
+    args = parser.parse_args()
+    print(f"{'nodes':>8} {'copy MB':>9} {'view MB':>9} {'saved':>7} {'copy s':>8} {'view s':>8}")
+    for nodes in args.nodes:
+        # a balanced tree of hash joins over scans
+        document, _ = PlanGenerator().get_explain("join_tree", nodes)
+        tree1 = get_tree(document[0])
+        tree2 = get_tree(document[0])
+        get_same_pattern(tree1, tree2)
+        copy_peak, copy_seconds = measure(tree1, tree2, deep_copy=True)
+        view_peak, view_seconds = measure(tree1, tree2, deep_copy=False)
+        print(
+            f"{len(tree1):>8} {copy_peak / 1e6:>9.2f} {view_peak / 1e6:>9.2f} "
+            f"{1 - view_peak / copy_peak:>7.0%} {copy_seconds:>8.3f} {view_seconds:>8.3f}"
+        )
@@ -0,0 +1,322 @@
+# The pipeline.py times each stage of a comparison on synthetic plans of growing size, reports how each
+# stage scales and compares the timings with a saved baseline
+# usage: python -m benchmark.pipeline [--shapes append bitmap] [--sizes 10 100 1000] [--save | --compare]
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import render
+from benchmark.plans import get_explain_text, get_plan_pair, plan_shapes
+from explain import (
+    draw_tree,
+    explain_tree,
+    get_qep_difference,
+    get_query_difference,
+    get_tree,
+    get_tree_from_text,
+    get_tree_tiles,
+)
+
+default_baseline = os.path.join(os.path.dirname(__file__), "baseline.json")
+default_sizes = [10, 100, 1000, 10000, 50000]
+
+# largest plans a stage is run on by default, past them it runs out of memory rather than time
+# the single image draw_tree makes of a wide plan of a few thousand nodes is gigabytes
+stage_limits = {"draw_tree": 1000}
+# every join of a chain lists all the relations under it, so the tree grows with the square of its depth
+shape_limits = {"join_chain": 10000}
+
+
+# one plan pair of a shape and size, with everything the stages start from
+class Case(object):
+    """Both EXPLAIN documents, their JSON text and both queries of a synthetic comparison."""
+
+    def __init__(self, shape: str, nodes: int, change: float, seed: int, dpi: int = 100):
+        self.dpi = dpi
+        self.plan1, self.plan2, self.query1, self.query2 = get_plan_pair(shape, nodes, change, seed)
+        self.text1 = get_explain_text(self.plan1)
+        self.text2 = get_explain_text(self.plan2)
+        # draw_tree saves the trees as png files, as batch.py --images does
+        self.image_dir = tempfile.TemporaryDirectory()
+
+    def get_trees(self) -> tuple:
+        return get_tree(self.plan1[0]), get_tree(self.plan2[0])
+
+    def get_image_paths(self) -> tuple:
+        return tuple(os.path.join(self.image_dir.name, f"tree{n}.png") for n in (1, 2))
+
+
+# the single tile of the coarsest level of both trees, what the viewer shows first, drawn in this process
+def render_overview(tree1, tree2, dpi: int) -> None:
+    for tiles in get_tree_tiles(tree1, tree2, dpi):
+        render.render_tile(*tiles.get_tile_job(tiles.levels - 1, 0, 0))
+
+
+def get_trees_from_text(case: Case) -> tuple:
+    return get_tree_from_text(case.text1), get_tree_from_text(case.text2)
+
+
+def explain_trees(tree1, tree2) -> tuple[str, str]:
+    return explain_tree(tree1), explain_tree(tree2)
+
+
+# stage name -> (what is prepared untimed from a case, what is timed), in pipeline order
+stages = {
+    "get_tree_from_text": (lambda case: (case,), get_trees_from_text),
+    "get_tree": (lambda case: (case,), Case.get_trees),
+    "explain_tree": (lambda case: case.get_trees(), explain_trees),
+    "get_qep_difference": (lambda case: case.get_trees(), get_qep_difference),
+    "draw_tree": (lambda case: case.get_trees() + (case.get_image_paths(), case.dpi), draw_tree),
+    "tiles": (lambda case: case.get_trees() + (case.dpi,), render_overview),
+    "get_query_difference": (lambda case: (case.query1, case.query2), get_query_difference),
+}
+
+
+# best time of a stage over repeat runs, a run longer than a second is not repeated
+def time_stage(stage: str, case: Case, repeat: int) -> float:
+    prepare, run = stages[stage]
+    best = math.inf
+    for _ in range(repeat):
+        args = prepare(case)
+        start = time.perf_counter()
+        run(*args)
+        seconds = time.perf_counter() - start
+        del args
+        best = min(best, seconds)
+        if seconds > 1:
+            break
+    return best
+
+
+# the exponent k of seconds ~ nodes ** k, a least squares fit in log-log
+# None with fewer than two usable points
+# timings under a millisecond are left out, they are mostly noise
+def get_scaling(timings: dict) -> float:
+    points = [
+        (math.log(int(nodes)), math.log(seconds))
+        for nodes, seconds in timings.items()
+        if isinstance(seconds, float) and seconds >= 0.001
+    ]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+# run every stage on every shape and size
+# results[shape][stage][nodes] is the seconds it took, or why the stage was not run
+def run_benchmark(
+    shapes: list,
+    sizes: list,
+    stage_names: list,
+    repeat: int,
+    change: float,
+    seed: int,
+    dpi: int,
+    time_limit: float,
+    limits: dict,
+) -> dict:
+    results = {}
+    for shape in shapes:
+        results[shape] = {stage: {} for stage in stage_names}
+        # stages that failed or would go over the time limit are not run on the larger sizes
+        stopped = {}
+        for nodes in sorted(sizes):
+            if nodes > shape_limits.get(shape, math.inf) and not limits.get("all"):
+                for stage in stage_names:
+                    results[shape][stage][str(nodes)] = f"over the {shape} limit"
+                continue
+            case = Case(shape, nodes, change, seed, dpi)
+            print(f"{shape} {nodes} nodes ...", file=sys.stderr, flush=True)
+            for stage in stage_names:
+                timings = results[shape][stage]
+                if stage in stopped:
+                    timings[str(nodes)] = stopped[stage]
+                    continue
+                if nodes > limits.get(stage, stage_limits.get(stage, math.inf)):
+                    timings[str(nodes)] = "over the stage limit"
+                    continue
+                # extrapolated from the largest size so far, at least linearly
+                measured = [(int(n), t) for n, t in timings.items() if isinstance(t, float)]
+                if measured:
+                    last_nodes, last_seconds = measured[-1]
+                    k = max(get_scaling(timings) or 1.0, 1.0)
+                    if last_seconds * (nodes / last_nodes) ** k > time_limit:
+                        stopped[stage] = f"over {time_limit:g} s expected"
+                        timings[str(nodes)] = stopped[stage]
+                        continue
+                try:
+                    seconds = time_stage(stage, case, repeat)
+                except Exception as e:
+                    stopped[stage] = f"failed at {nodes}"
+                    timings[str(nodes)] = f"{e.__class__.__name__}: {e}"
+                    continue
+                timings[str(nodes)] = seconds
+            del case
+    return results
+
+
+def format_seconds(seconds) -> str:
+    if not isinstance(seconds, float):
+        return "-"
+    if seconds < 1:
+        return f"{seconds * 1000:.1f}ms"
+    return f"{seconds:.2f}s"
+
+
+# a table per shape with a row per stage, a column per size and the fitted exponent
+def print_report(results: dict, sizes: list) -> None:
+    sizes = [str(nodes) for nodes in sorted(sizes)]
+    notes = []
+    for shape, shape_results in results.items():
+        print(f"\n{shape}")
+        print(f"{'stage':<22}" + "".join(f"{nodes:>10}" for nodes in sizes) + f"{'~n^k':>8}")
+        for stage, timings in shape_results.items():
+            row = f"{stage:<22}"
+            for nodes in sizes:
+                seconds = timings.get(nodes)
+                row += f"{format_seconds(seconds):>10}"
+                if isinstance(seconds, str) and not seconds.startswith(("over", "failed at")):
+                    notes.append(f"{shape} {stage} {nodes}: {seconds}")
+            k = get_scaling(timings)
+            row += f"{'' if k is None else f'{k:.2f}':>8}"
+            print(row)
+    print(
+        "\n- not run, over a node limit (--max-nodes), expected over --time-limit "
+        "or failed on a smaller plan"
+    )
+    if notes:
+        print("\nfailed:")
+        for note in notes:
+            print(f"  {note}")
+
+
+# the stages that are slower than in the baseline, by more than tolerance times and min_seconds,
+# or that were timed in the baseline and now failed or were not run
+def compare_baseline(results: dict, baseline: dict, tolerance: float, min_seconds: float) -> list[str]:
+    regressions = []
+    for shape, shape_results in results.items():
+        for stage, timings in shape_results.items():
+            old_timings = baseline["results"].get(shape, {}).get(stage, {})
+            for nodes, seconds in timings.items():
+                old = old_timings.get(nodes)
+                if not isinstance(old, float):
+                    continue
+                if not isinstance(seconds, float):
+                    regressions.append(f"{shape} {stage} {nodes}: {seconds}, baseline {format_seconds(old)}")
+                    continue
+                if seconds > old * tolerance and seconds - old > min_seconds:
+                    regressions.append(
+                        f"{shape} {stage} {nodes}: {format_seconds(seconds)}, "
+                        f"baseline {format_seconds(old)} ({seconds / old:.2f}x)"
+                    )
+    return regressions
+
+
+def get_environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time every stage of a comparison on synthetic plans, without a database."
+    )
+    parser.add_argument("--shapes", nargs="+", choices=plan_shapes, default=plan_shapes)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=default_sizes, help="about how many nodes each plan has"
+    )
+    parser.add_argument("--stages", nargs="+", choices=list(stages), default=list(stages))
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage, the best one is kept")
+    parser.add_argument(
+        "--change", type=float, default=0.1, help="share of the second plan that is planned differently"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=100,
+        help="resolution of draw_tree and the tiles, the GUI uses 500, the time grows with its square",
+    )
+    parser.add_argument(
+        "--time-limit",
+        type=float,
+        default=30,
+        help="a stage is not run on a larger plan that is expected to take longer than this",
+    )
+    parser.add_argument(
+        "--max-nodes",
+        action="append",
+        default=[],
+        metavar="STAGE=N",
+        help="override the largest plans a stage is run on, all=1 also lifts the limits of the shapes",
+    )
+    parser.add_argument(
+        "--save", nargs="?", const=default_baseline, help="store the timings as the baseline"
+    )
+    parser.add_argument(
+        "--compare", nargs="?", const=default_baseline, help="compare the timings with a stored baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=1.5, help="slowdown against the baseline that is a regression"
+    )
+    parser.add_argument(
+        "--min-seconds", type=float, default=0.01, help="slowdowns smaller than this are ignored"
+    )
+    args = parser.parse_args()
+    limits = {}
+    for limit in args.max_nodes:
+        stage, _, nodes = limit.partition("=")
+        limits[stage] = int(nodes)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    # every stage once before anything is timed,
+    # to import what is only imported on first use and start the render workers
+    warm_up = Case("join_tree", 10, args.change, args.seed, args.dpi)
+    for stage in args.stages:
+        time_stage(stage, warm_up, 1)
+    settings = {"change": args.change, "seed": args.seed, "dpi": args.dpi}
+    if baseline is not None and baseline["settings"] != settings:
+        parser.error(f"the baseline was taken with {baseline['settings']}, not {settings}")
+    results = run_benchmark(
+        args.shapes,
+        args.sizes,
+        args.stages,
+        args.repeat,
+        args.change,
+        args.seed,
+        args.dpi,
+        args.time_limit,
+        limits,
+    )
+    print_report(results, args.sizes)
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(
+                {"environment": get_environment(), "settings": settings, "results": results}, f, indent=2
+            )
+        print(f"\nbaseline saved to {args.save}")
+    if baseline is not None:
+        regressions = compare_baseline(results, baseline, args.tolerance, args.min_seconds)
+        print(f"\ncompared with {args.compare}, taken on {baseline['environment']}")
+        for regression in regressions:
+            print(f"  slower: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("  no regressions")
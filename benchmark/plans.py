@@ -0,0 +1,341 @@
+# The plans.py generates synthetic EXPLAIN (FORMAT JSON) output and the SQL it would come from,
+# so the comparison pipeline can be measured without a database
+# usage: python -m benchmark.plans join_chain 1000 [--change 0.1] > plan.json
+import argparse
+import json
+import random
+from contextlib import contextmanager
+
+# the shapes of plan the generator knows, see PlanGenerator
+plan_shapes = ["join_chain", "join_tree", "append", "bitmap", "aggregate"]
+
+
+class RawJson(str):
+    """JSON text that is written as it is by get_explain_text."""
+
+
+# the JSON text of an EXPLAIN document as psql prints it, without the indentation
+# json.dumps recurses once per level, so a join chain thousands of nodes deep
+# is written with an explicit stack instead
+def get_explain_text(document) -> str:
+    parts = []
+    stack = [document]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, RawJson):
+            parts.append(value)
+        elif isinstance(value, dict):
+            stack.append(RawJson("}"))
+            items = list(value.items())
+            for n in reversed(range(len(items))):
+                key, item = items[n]
+                stack.append(item)
+                stack.append(RawJson((", " if n else "") + json.dumps(key) + ": "))
+            stack.append(RawJson("{"))
+        elif isinstance(value, list):
+            stack.append(RawJson("]"))
+            for n in reversed(range(len(value))):
+                stack.append(value[n])
+                if n:
+                    stack.append(RawJson(", "))
+            stack.append(RawJson("["))
+        else:
+            parts.append(json.dumps(value))
+    return "".join(parts)
+
+
+class PlanGenerator(object):
+    """Builds EXPLAIN plans of a given shape and about a given number of nodes, with the matching SQL."""
+
+    def __init__(self, seed: int = 0, change: float = 0.0, analyze: bool = True):
+        # the structure and the numbers come from rng, what is changed from variation,
+        # so the same seed with and without change gives two versions of the same plan
+        self.rng = random.Random(seed)
+        self.variation = random.Random(seed + 1)
+        self.change = change
+        self.analyze = analyze
+
+    # whether this part of the plan is different from the unchanged plan
+    def changed(self) -> bool:
+        return self.change > 0 and self.variation.random() < self.change
+
+    # a join, scan or subquery is generated from its own random numbers,
+    # so a change inside it does not shift the numbers of the rest of the plan
+    @contextmanager
+    def unit(self):
+        rng = self.rng
+        self.rng = random.Random(rng.random())
+        try:
+            yield
+        finally:
+            self.rng = rng
+
+    # a plan node with made up but consistent costs, rows and timings on top of its children's
+    def node(self, node_type: str, children: list = (), rows: int = None, **attributes) -> dict:
+        if rows is None:
+            rows = self.rng.randint(1, 100000)
+        startup = sum(child["Total Cost"] for child in children) * 0.1
+        total = sum(child["Total Cost"] for child in children) + rows * 0.01 + self.rng.random() * 100
+        node = {"Node Type": node_type}
+        node.update(attributes)
+        node.update(
+            {
+                "Startup Cost": round(startup, 2),
+                "Total Cost": round(total, 2),
+                "Plan Rows": rows,
+                "Plan Width": self.rng.choice([4, 8, 16, 32, 64]),
+            }
+        )
+        if self.analyze:
+            node.update(
+                {
+                    "Actual Startup Time": round(startup / 100, 3),
+                    "Actual Total Time": round(total / 100, 3),
+                    "Actual Rows": max(int(rows * self.rng.uniform(0.5, 2.0)), 0),
+                    "Actual Loops": 1,
+                }
+            )
+        if children:
+            relationships = ["Outer", "Inner"]
+            if node_type == "Append":
+                relationships = ["Member"] * len(children)
+            elif node_type == "Subquery Scan":
+                relationships = ["Subquery"]
+            for child, relationship in zip(children, relationships):
+                child.setdefault("Parent Relationship", relationship)
+            node["Plans"] = list(children)
+        return node
+
+    def seq_scan(self, table: str, condition: str = None) -> dict:
+        attributes = {"Relation Name": table, "Alias": table}
+        if condition is not None:
+            attributes["Filter"] = f"({condition})"
+        return self.node("Seq Scan", **attributes)
+
+    def index_scan(self, table: str, condition: str) -> dict:
+        return self.node(
+            "Index Scan",
+            rows=self.rng.randint(1, 100),
+            **{
+                "Scan Direction": "Forward",
+                "Index Name": f"{table}_pkey",
+                "Relation Name": table,
+                "Alias": table,
+                "Index Cond": f"({condition})",
+            },
+        )
+
+    # a scan of table filtered on column, a sequential scan or an index scan as the plan would pick it
+    def scan(self, table: str, column: str, value: int) -> dict:
+        with self.unit():
+            index = self.rng.random() < 0.3
+            if self.changed():
+                index = not index
+            if index:
+                return self.index_scan(table, f"{table}.{column} = {value}")
+            return self.seq_scan(table, f"{table}.{column} > {value}")
+
+    # join outer with a scan of table on condition, by hash, merge or nested loop, 3 nodes on average
+    def join(self, outer: dict, table: str, condition: str) -> dict:
+        with self.unit():
+            return self.join_with(outer, table, condition)
+
+    def join_with(self, outer: dict, table: str, condition: str) -> dict:
+        method = self.rng.choice(["Hash Join", "Hash Join", "Merge Join", "Nested Loop"])
+        if self.changed():
+            method = "Nested Loop" if method == "Hash Join" else "Hash Join"
+        join_type = "Inner"
+        if method == "Hash Join":
+            inner = self.node("Hash", [self.seq_scan(table)])
+            return self.node(
+                method, [outer, inner], **{"Join Type": join_type, "Hash Cond": f"({condition})"}
+            )
+        if method == "Merge Join":
+            outer = self.node("Sort", [outer], **{"Sort Key": [condition.split(" = ")[0]]})
+            inner = self.node(
+                "Sort", [self.seq_scan(table)], **{"Sort Key": [condition.split(" = ")[1]]}
+            )
+            return self.node(
+                method, [outer, inner], **{"Join Type": join_type, "Merge Cond": f"({condition})"}
+            )
+        inner = self.index_scan(table, condition)
+        return self.node(method, [outer, inner], **{"Join Type": join_type})
+
+    # a left-deep chain of joins, one table after the other
+    # the number of parts is fixed by nodes so both versions of a plan join the same tables
+    def join_chain(self, nodes: int) -> tuple[dict, str]:
+        value = self.rng.randint(1, 1000)
+        plan = self.scan("t0", "a", value)
+        sql = "SELECT count(*)\nFROM t0"
+        for i in range(1, max((nodes - 2) // 3, 1) + 1):
+            condition = f"t{i - 1}.id = t{i}.t{i - 1}_id"
+            plan = self.join(plan, f"t{i}", condition)
+            sql += f"\nJOIN t{i} ON {condition}"
+        sql += f"\nWHERE t0.a > {value}"
+        return self.node("Aggregate", [plan], rows=1, Strategy="Plain"), sql
+
+    # hash joins over scans, paired up level by level into a balanced tree
+    def join_tree(self, nodes: int) -> tuple[dict, str]:
+        tables = [f"t{i}" for i in range(max((nodes + 1) // 3, 2))]
+        level = [self.scan(table, "a", self.rng.randint(1, 1000)) for table in tables]
+        conditions = []
+        while len(level) > 1:
+            joined = []
+            for i in range(0, len(level) - 1, 2):
+                condition = f"j{len(conditions)}.x = j{len(conditions)}.y"
+                conditions.append(condition)
+                joined.append(
+                    self.node(
+                        "Hash Join",
+                        [level[i], self.node("Hash", [level[i + 1]])],
+                        **{"Join Type": "Inner", "Hash Cond": f"({condition})"},
+                    )
+                )
+            if len(level) % 2:
+                joined.append(level[-1])
+            level = joined
+        sql = "SELECT *\nFROM " + ", ".join(tables) + "\nWHERE " + "\n  AND ".join(conditions)
+        return level[0], sql
+
+    # an aggregate over an append of one scan per partition, as for a partitioned table
+    def append(self, nodes: int) -> tuple[dict, str]:
+        value = self.rng.randint(1, 1000)
+        scans = []
+        # the aggregates and the append are three nodes of their own
+        for i in range(max(nodes - 3, 1)):
+            partition = f"measurements_p{i}"
+            with self.unit():
+                # a partition with other statistics is scanned by index
+                if self.changed():
+                    scans.append(self.index_scan(partition, f"{partition}.reading > {value}"))
+                else:
+                    scans.append(self.seq_scan(partition, f"{partition}.reading > {value}"))
+        plan = self.node("Append", scans, rows=sum(scan["Plan Rows"] for scan in scans))
+        plan = self.node(
+            "Aggregate", [plan], rows=len(scans), Strategy="Partial", **{"Partial Mode": "Partial"}
+        )
+        plan = self.node("Aggregate", [plan], rows=1, Strategy="Plain", **{"Partial Mode": "Finalize"})
+        sql = f"SELECT count(*), avg(reading)\nFROM measurements\nWHERE reading > {value}"
+        return plan, sql
+
+    # a bitmap heap scan of table on one or more of its indexes, 3.7 nodes on average
+    def bitmap_scan(self, table: str) -> tuple[dict, str]:
+        with self.unit():
+            return self.bitmap_scan_with(table)
+
+    def bitmap_scan_with(self, table: str) -> tuple[dict, str]:
+        columns = ["a", "b", "c"][: self.rng.randint(1, 3)]
+        if self.changed():
+            columns = columns[:-1] or ["a", "b"]
+        conditions = [f"{table}.{column} = {self.rng.randint(1, 1000)}" for column in columns]
+        index_scans = [
+            self.node(
+                "Bitmap Index Scan",
+                **{"Index Name": f"{table}_{column}_idx", "Index Cond": f"({condition})"},
+            )
+            for column, condition in zip(columns, conditions)
+        ]
+        operator = self.rng.choice(["BitmapOr", "BitmapAnd"])
+        bitmap = index_scans[0] if len(index_scans) == 1 else self.node(operator, index_scans)
+        keyword = " OR " if operator == "BitmapOr" else " AND "
+        condition = "(" + keyword.join(conditions) + ")"
+        return (
+            self.node(
+                "Bitmap Heap Scan",
+                [bitmap],
+                **{"Relation Name": table, "Alias": table, "Recheck Cond": condition},
+            ),
+            condition,
+        )
+
+    # nested loops over bitmap heap scans, one table after the other
+    def bitmap(self, nodes: int) -> tuple[dict, str]:
+        plan, condition = self.bitmap_scan("t0")
+        conditions = [condition]
+        tables = ["t0"]
+        for i in range(1, max(int((nodes - 4) / 4.7), 1) + 1):
+            scan, condition = self.bitmap_scan(f"t{i}")
+            conditions.append(condition)
+            tables.append(f"t{i}")
+            plan = self.node(
+                "Nested Loop",
+                [plan, scan],
+                **{"Join Type": "Inner", "Join Filter": f"(t{i - 1}.id = t{i}.t{i - 1}_id)"},
+            )
+            conditions.append(f"t{i - 1}.id = t{i}.t{i - 1}_id")
+        sql = "SELECT *\nFROM " + ", ".join(tables) + "\nWHERE " + "\n  AND ".join(conditions)
+        return plan, sql
+
+    # the union of grouped joins, each a sort and group aggregate over a hash join, about 7 nodes each
+    def aggregate(self, nodes: int) -> tuple[dict, str]:
+        parts = []
+        queries = []
+        for i in range(max((nodes - 2) // 7, 1)):
+            with self.unit():
+                parts.append(self.grouped_join(i))
+            orders, items = f"orders_{i}", f"items_{i}"
+            queries.append(
+                f"SELECT {orders}.customer_id, sum({items}.price)\n"
+                f"FROM {orders} JOIN {items} ON {orders}.id = {items}.order_id\n"
+                f"GROUP BY {orders}.customer_id"
+            )
+        plan = self.node("Append", parts)
+        plan = self.node("Sort", [plan], **{"Sort Key": ["customer_id"]})
+        return plan, "\nUNION ALL\n".join(queries) + "\nORDER BY customer_id"
+
+    def grouped_join(self, i: int) -> dict:
+        orders, items = f"orders_{i}", f"items_{i}"
+        condition = f"{orders}.id = {items}.order_id"
+        join = self.node(
+            "Hash Join",
+            [self.seq_scan(items), self.node("Hash", [self.seq_scan(orders)])],
+            **{"Join Type": "Inner", "Hash Cond": f"({condition})"},
+        )
+        key = [f"{orders}.customer_id"]
+        if self.changed():
+            plan = self.node("HashAggregate", [join], Strategy="Hashed", **{"Group Key": key})
+        else:
+            sort = self.node("Sort", [join], **{"Sort Key": key})
+            plan = self.node("Aggregate", [sort], Strategy="Sorted", **{"Group Key": key})
+        return self.node("Subquery Scan", [plan], Alias=f"*SELECT* {i + 1}")
+
+    # the EXPLAIN document of a plan of the shape and its SQL
+    # the document is a list with a single entry, as EXPLAIN returns it
+    def get_explain(self, shape: str, nodes: int) -> tuple[list, str]:
+        if shape not in plan_shapes:
+            raise ValueError(f"unknown plan shape {shape}")
+        plan, sql = getattr(self, shape)(nodes)
+        document = {"Plan": plan, "Planning Time": round(self.rng.uniform(0.1, 50.0), 3)}
+        if self.analyze:
+            document["Triggers"] = []
+            document["Execution Time"] = round(plan["Actual Total Time"] + self.rng.random(), 3)
+        return [document], sql
+
+
+# two versions of a plan of the shape with about the given number of nodes, as a comparison gets them
+# change is the share of the joins, scans and aggregates planned differently in the second one
+# returns both EXPLAIN documents and both queries
+def get_plan_pair(
+    shape: str, nodes: int, change: float = 0.1, seed: int = 0, analyze: bool = True
+) -> tuple[list, list, str, str]:
+    plan1, query1 = PlanGenerator(seed, 0.0, analyze).get_explain(shape, nodes)
+    plan2, query2 = PlanGenerator(seed, change, analyze).get_explain(shape, nodes)
+    return plan1, plan2, query1, query2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Print a synthetic EXPLAIN (FORMAT JSON) document."
+    )
+    parser.add_argument("shape", choices=plan_shapes)
+    parser.add_argument("nodes", type=int)
+    parser.add_argument("--change", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--estimate-only", action="store_true", help="plain EXPLAIN, without actual times"
+    )
+    parser.add_argument("--sql", action="store_true", help="print the query instead of the plan")
+    args = parser.parse_args()
+    generator = PlanGenerator(args.seed, args.change, not args.estimate_only)
+    document, sql = generator.get_explain(args.shape, args.nodes)
+    print(sql if args.sql else get_explain_text(document))
@@ -0,0 +1,83 @@
+# The scaling.py checks that matching the differing nodes of two plans stays linear in their number
+# usage: python -m benchmark.scaling [--joins 1000 2000 4000] [--tolerance 1.5]
+import argparse
+import sys
+import time
+
+from benchmark.plans import PlanGenerator
+from explain import get_diff_nodes, get_join_difference, get_qep_difference, get_same_pattern, get_tree
+
+
+# an append of joins that have nothing in common, with change=1.0 every join of the second plan
+# uses another method, so none of them are in a shared subtree and all are left to match_nodes
+def get_joins_plan(joins: int, change: float, seed: int = 0) -> dict:
+    generator = PlanGenerator(seed, change, analyze=False)
+    parts = []
+    for i in range(joins):
+        with generator.unit():
+            scan = generator.scan(f"a{i}", "x", generator.rng.randint(1, 1000))
+            parts.append(generator.join_with(scan, f"b{i}", f"a{i}.id = b{i}.a{i}_id"))
+    return {"Plan": generator.node("Append", parts)}
+
+
+# the differing joins of both plans, once get_same_pattern has marked the rest
+def get_diff_joins(tree1, tree2) -> tuple[list, list]:
+    get_same_pattern(tree1, tree2)
+    return (
+        [node for node in get_diff_nodes(tree1) if node["Category"] == "Join"],
+        [node for node in get_diff_nodes(tree2) if node["Category"] == "Join"],
+    )
+
+
+# best time over repeat runs of get_join_difference, which pairs the joins through match_nodes,
+# and of the whole get_qep_difference, on fresh trees each run
+def time_joins(joins: int, repeat: int) -> tuple[float, float, int]:
+    plan1, plan2 = get_joins_plan(joins, 0.0), get_joins_plan(joins, 1.0)
+    best_match = best_qep = float("inf")
+    for _ in range(repeat):
+        diff_a, diff_b = get_diff_joins(get_tree(plan1), get_tree(plan2))
+        start = time.perf_counter()
+        get_join_difference(diff_a, diff_b)
+        best_match = min(best_match, time.perf_counter() - start)
+        tree1, tree2 = get_tree(plan1), get_tree(plan2)
+        start = time.perf_counter()
+        get_qep_difference(tree1, tree2)
+        best_qep = min(best_qep, time.perf_counter() - start)
+    return best_match, best_qep, len(diff_a)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that matching differing joins takes time linear in their number."
+    )
+    parser.add_argument("--joins", type=int, nargs="+", default=[1000, 2000, 4000])
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each size, the best one is kept")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="how much more than linear the time may grow from the smallest to the largest size",
+    )
+    args = parser.parse_args()
+    sizes = sorted(args.joins)
+    # once before timing, to import what is only imported on first use
+    time_joins(10, 1)
+    timings = {}
+    for joins in sizes:
+        timings[joins] = time_joins(joins, args.repeat)
+        match_seconds, qep_seconds, differing = timings[joins]
+        print(
+            f"{joins:>7} joins, {differing} differing: "
+            f"get_join_difference {match_seconds * 1000:.1f}ms, get_qep_difference {qep_seconds * 1000:.1f}ms"
+        )
+    smallest, largest = sizes[0], sizes[-1]
+    if timings[smallest][2] < smallest:
+        print(f"only {timings[smallest][2]} of {smallest} joins differ, the plans do not test the matching")
+        sys.exit(1)
+    failed = False
+    for n, name in enumerate(["get_join_difference", "get_qep_difference"]):
+        ratio = timings[largest][n] / timings[smallest][n]
+        allowed = largest / smallest * args.tolerance
+        print(f"{name}: {ratio:.2f}x the time for {largest / smallest:g}x the joins, allowed {allowed:.2f}x")
+        failed = failed or ratio > allowed
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,88 @@
+# The startup.py measures the time project.py needs before the dialog can be shown,
+# and checks that the plotting and diffing libraries are left for the first comparison
+# usage: python -m benchmark.startup [--runs 5] [--budget 0.5]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# modules that are only needed once a comparison runs, importing any of them at startup is a regression
+deferred_modules = ["matplotlib", "networkx", "numpy", "sqlparse", "tree_edit"]
+
+# run in a fresh interpreter each time, so nothing is already imported or cached in memory
+# the dialog is shown by project.py's own start-up code, with the options parsed from argv[2:],
+# including opening the plan store
+startup_script = """
+import json, os, sys, time
+start = time.perf_counter()
+import project
+imported = time.perf_counter() - start
+if len(sys.argv) > 2:
+    app, dialog, ui = project.show_dialog(sys.argv[2:])
+    app.processEvents()
+shown = time.perf_counter() - start
+print(json.dumps({
+    "import": imported,
+    "shown": shown,
+    "loaded": [name for name in sys.argv[1].split(",") if name in sys.modules],
+}), flush=True)
+# the render workers hold on to stdout, so they are stopped before leaving
+import render
+if render.render_pool is not None:
+    render.render_pool.shutdown(cancel_futures=True)
+# only the startup is measured, the Qt objects are not torn down
+os._exit(0)
+"""
+
+
+# seconds to import project.py and to show its dialog, and the deferred modules that were loaded anyway
+# without project arguments only the import is timed
+def measure(project_args: list = None) -> dict:
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    command = [sys.executable, "-c", startup_script, ",".join(deferred_modules)]
+    if project_args is not None:
+        command += project_args
+    output = subprocess.run(command, capture_output=True, text=True, env=env, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure how long project.py takes to show its dialog."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget", type=float, default=0.5, help="seconds allowed until the dialog is shown"
+    )
+    parser.add_argument("--renderer", choices=["matplotlib", "qt"], default="matplotlib")
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="plan store project.py opens, its default one when not given",
+    )
+    parser.add_argument(
+        "--no-dialog", action="store_true", help="only time the imports, without Qt showing the dialog"
+    )
+    args = parser.parse_args()
+    # port 1 is refused, the connection is made in the background and not waited for
+    project_args = [
+        "--host", "localhost", "--port", "1", "--database", "postgres", "--user", "postgres",
+        "--password", "", "--renderer", args.renderer,
+    ]
+    if args.cache_dir is not None:
+        project_args += ["--cache-dir", args.cache_dir]
+    start = time.perf_counter()
+    runs = [measure(None if args.no_dialog else project_args) for _ in range(args.runs)]
+    # the best run is the least disturbed by the rest of the machine
+    best_import = min(run["import"] for run in runs)
+    best_shown = min(run["shown"] for run in runs)
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+    print(f"import project:   {best_import:.3f} s")
+    print(f"dialog shown:     {best_shown:.3f} s (budget {args.budget:.3f} s)")
+    print(f"deferred modules loaded: {', '.join(loaded) or 'none'}")
+    if best_shown > args.budget or loaded:
+        sys.exit(1)
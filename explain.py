@@ -1,49 +1,62 @@
 # The explain.py contains the code for generating the explanation.
 import difflib
 import logging
-import copy
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 import textwrap
+import hashlib
 import html
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 
 
-import matplotlib.pyplot as plt
 import psycopg2
-import networkx as nx
-import sqlparse
+import psycopg2.extras
+
+try:
+    # optional, lets a plan be turned into a tree while its JSON is parsed instead of decoded in full first
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    # optional, faster drop-in for json.loads when ijson is not there
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from plan_source import PlanSource
+from plan_tree import PlanNode, PlanTree, useful_attributes
+from render import TiledTree, render_trees
+from tracing import Trace, logger_name, null_trace, write_trace
 
 
 def hierarchy_pos(
-    G: nx.DiGraph, root: int = None, width=1.0, vert_gap=0.2, vert_loc=0, xcenter=0.5
+    G: PlanTree, root: int = None, width=1.0, vert_gap=0.2, vert_loc=0, xcenter=0.5
 ) -> dict[int, tuple[float, float]]:
-    # helper function to create a tree-like layout using BFS for the graph visualization
-    def _hierarchy_pos(
-        G, root, width=1.0, vert_gap=0.2, vert_loc=0, xcenter=0.5, pos=None, parent=None
-    ):
-        if pos is None:
-            pos = {root: (xcenter, vert_loc)}
-        else:
-            pos[root] = (xcenter, vert_loc)
-        children = list(G.neighbors(root))
-        if not isinstance(G, nx.DiGraph) and parent is not None:
-            children.remove(parent)
+    # helper function to create a tree-like layout for the graph visualization
+    # each child gets an equal share of its parent's width, walked with an explicit stack for deep plans
+    pos = {}
+    stack = [(root, width, vert_loc, xcenter)]
+    while stack:
+        node_id, width, vert_loc, xcenter = stack.pop()
+        pos[node_id] = (xcenter, vert_loc)
+        children = list(G.successors(node_id))
         if len(children) != 0:
             dx = width / len(children)
             nextx = xcenter - width / 2 - dx / 2
+            placed = []
             for child in children:
                 nextx += dx
-                pos = _hierarchy_pos(
-                    G,
-                    child,
-                    width=dx,
-                    vert_gap=vert_gap,
-                    vert_loc=vert_loc - vert_gap,
-                    xcenter=nextx,
-                    pos=pos,
-                    parent=root,
-                )
-        return pos
-
-    return _hierarchy_pos(G, root, width, vert_gap, vert_loc, xcenter)
+                placed.append((child, dx, vert_loc - vert_gap, nextx))
+            # reversed so the first child is laid out first
+            stack.extend(reversed(placed))
+    return pos
+
 
 def get_label(node: dict) -> str:
     ret = f"""{node["Node Type"]}\n"""
@@ -70,93 +83,282 @@ def get_label(node: dict) -> str:
             ret += f"""{attri}:\n{textwrap.fill(str(node[attri]), 25)}\n"""
     return ret
 
+# positions, labels, colours, edges and figure size in inches of a tree, as render.py draws it
+# matched nodes are green and the rest red, get_same_pattern must have been run
+def get_tree_layout(tree: PlanTree) -> tuple:
+    colors = ["green" if pattern_id is not None else "red" for pattern_id in tree.pattern_id]
+    labels = {}
+    for node_id in range(len(tree)):
+        node_data = tree.nodes[node_id]
+        labels[node_id] = get_label(node_data)
+    pos = hierarchy_pos(tree, 0)
+    # number of nodes on each level, parents come before their children
+    depth = [0] * len(tree)
+    layer_sizes = {}
+    for node_id in range(len(tree)):
+        if tree.parent[node_id] != -1:
+            depth[node_id] = depth[tree.parent[node_id]] + 1
+        layer_sizes[depth[node_id]] = layer_sizes.get(depth[node_id], 0) + 1
+    max_depth = max(depth)
+    max_width = max(layer_sizes.values())
+    edges = [(tree.parent[node_id], node_id) for node_id in range(1, len(tree))]
+    # a single node plan still needs some height to be drawn
+    figsize = (max_width * 2, max(max_depth, 1) * 1.5)
+    return pos, labels, colors, edges, figsize
+
+
 # tree visualization
-def draw_tree(tree1: nx.DiGraph, tree2: nx.DiGraph) -> None:
-    # draw the tree and save it to a png
-    tree1_copy = copy.deepcopy(tree1)
-    tree2_copy = copy.deepcopy(tree2)
-    # assume all of the nodes are different and red
-    color_maps = [["red"] * len(tree1_copy.nodes), ["red"] * len(tree2_copy.nodes)]
-    for node_id1, node_data1 in tree1_copy.nodes.data():
-        for node_id2, node_data2 in tree2_copy.nodes.data():
-            if node_data1 == node_data2:
-                # set the same node to green
-                color_maps[0][node_id1] = "green"
-                color_maps[1][node_id2] = "green"
-    # draw the trees one by one
-    for n, tree in enumerate([tree1_copy, tree2_copy]):
-        labels = {}
-        for node_id in range(max(tree.nodes) + 1):
-            node_data = tree.nodes[node_id]
-            labels[node_id] = get_label(node_data)
-        pos = hierarchy_pos(tree, 0)
-        max_depth = nx.dag_longest_path_length(tree, 0)
-        max_width = 0
-        for layer in nx.bfs_layers(tree, 0):
-            if len(layer) > max_width:
-                max_width = len(layer)
-        # convert it to a undirected graph as we don't need to draw the direction of the edges
-        tree = nx.Graph(tree)
-        fig = plt.figure(figsize=(max_width * 2, max_depth * 1.5))        
-        fig.tight_layout()
-        nx.draw_networkx(
-            tree,
-            pos=pos,
-            node_shape="o",
-            node_size=200,
-            node_color=color_maps[n],
-            linewidths=2,
-            with_labels=False,
+def draw_tree(tree1: PlanTree, tree2: PlanTree, filenames: tuple, dpi: int = 500) -> None:
+    # draw the trees and save them to the png files filenames
+    # both trees are drawn at the same time by the worker processes of render.py
+    # matched nodes are green and the rest red, the matching is kept for get_qep_difference
+    get_same_pattern(tree1, tree2)
+    # the renderer only gets the layout, the trees themselves are only read
+    jobs = [get_tree_layout(tree) + (dpi, filename) for tree, filename in zip([tree1, tree2], filenames)]
+    render_trees(jobs)
+
+
+# the same drawings as draw_tree, as tile pyramids whose tiles are only rendered when a viewer asks for them,
+# so a huge plan is never held as one image
+def get_tree_tiles(tree1: PlanTree, tree2: PlanTree, dpi: int = 500) -> list[TiledTree]:
+    get_same_pattern(tree1, tree2)
+    return [TiledTree(*get_tree_layout(tree), dpi) for tree in (tree1, tree2)]
+
+
+# what a renderer needs to draw a tree: (node id, parent id or -1, x, y, label, colour) for each node
+# x and y are in scene units, y grows downwards, the layout is the same as draw_tree's
+def get_tree_drawing(
+    tree: PlanTree, node_spacing: float = 200.0, level_spacing: float = 150.0
+) -> list[tuple]:
+    # matched nodes are green and the rest red, get_same_pattern must have been run
+    pos = hierarchy_pos(tree, 0, vert_gap=1.0)
+    layer_sizes = {}
+    for _, y in pos.values():
+        layer_sizes[y] = layer_sizes.get(y, 0) + 1
+    width = max(layer_sizes.values()) * node_spacing
+    return [
+        (
+            node_id,
+            tree.parent[node_id],
+            pos[node_id][0] * width,
+            -pos[node_id][1] * level_spacing,
+            get_label(node),
+            "green" if tree.pattern_id[node_id] is not None else "red",
         )
-        nx.draw_networkx_labels(tree, pos=pos, labels=labels, font_size=3, font_color="#663300")
-        # save the figure given the filename
-        plt.axis("off")
-        plt.savefig(f"tree{n+1}.png", dpi=500)
-        plt.clf()
+        for node_id, node in enumerate(tree.nodes)
+    ]
+
+
+# raised when a running comparison is cancelled by the user
+class ComparisonCancelled(Exception):
+    pass
 
 
 # Database connection
 class DatabaseManager(object):
     """class that handles the interaction between python code and PostgreSQL"""
 
-    def __init__(self, host: str, port: str, database: str, user: str, password: str):
+    def __init__(
+        self,
+        host: str,
+        port: str,
+        database: str,
+        user: str,
+        password: str,
+        min_connections: int = 1,
+        max_connections: int = 4,
+        session_settings: dict = None,
+        health_check_interval: float = 30.0,
+    ):
         super(DatabaseManager, self).__init__()
-        self.conn = psycopg2.connect(
+        self.connect_kwargs = dict(
             host=host,
             database=database,
             user=user,
             password=password,
             port=port,
         )
-        self.cur = self.conn.cursor()
+        # run-time parameters applied to every new connection, e.g. {"work_mem": "64MB"}
+        self.session_settings = session_settings or {}
+        self.max_connections = max(max_connections, min_connections, 1)
+        # connections idle for longer than this are pinged before being handed out
+        self.health_check_interval = health_check_interval
+        self.lock = threading.Condition()
+        self.idle = []  # (connection, last used time), most recently used last
+        self.active = set()  # connections currently checked out
+        self.pending = 0  # connections being opened
+        self.server_version = None
+        for _ in range(min_connections):
+            self.idle.append((self.connect(), time.monotonic()))
         logging.info("DBMS connection successful")
 
+    # identifies the server and database the plans come from, used to key persistent caches
+    @property
+    def server_identity(self) -> str:
+        kwargs = self.connect_kwargs
+        return f"""{kwargs["host"]}:{kwargs["port"]}/{kwargs["database"]}@{self.server_version}"""
+
+    # open a new connection with the session settings applied
+    def connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        self.server_version = conn.server_version
+        if self.session_settings:
+            with conn.cursor() as cur:
+                for name, value in self.session_settings.items():
+                    cur.execute("SELECT set_config(%s, %s, false)", (name, str(value)))
+            # commit so the settings outlive this transaction
+            conn.commit()
+        return conn
+
+    # check that an idle connection can still be used
+    def is_alive(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    # take a connection from the pool, opening a new one if needed
+    # the health check and the connect run outside the lock, so a slow server only holds up this caller
+    def acquire(self):
+        while True:
+            with self.lock:
+                while not self.idle and len(self.active) + self.pending >= self.max_connections:
+                    self.lock.wait()
+                conn = None
+                if self.idle:
+                    conn, last_used = self.idle.pop()
+                # the slot is reserved while the connection is checked or opened
+                self.pending += 1
+            if conn is None:
+                break
+            alive = self.is_alive(conn, last_used)
+            with self.lock:
+                self.pending -= 1
+                if alive:
+                    self.active.add(conn)
+                    return conn
+                self.lock.notify()
+            logging.info("discarding dead DBMS connection")
+            self.close(conn)
+        try:
+            conn = self.connect()
+        except Exception:
+            with self.lock:
+                self.pending -= 1
+                self.lock.notify()
+            raise
+        with self.lock:
+            self.pending -= 1
+            self.active.add(conn)
+        return conn
+
+    # give a connection back, ending its transaction so it is clean for the next user
+    def release(self, conn) -> None:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self.close(conn)
+        with self.lock:
+            self.active.discard(conn)
+            if not conn.closed:
+                self.idle.append((conn, time.monotonic()))
+            self.lock.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    # run a statement on a pooled connection and return all rows
+    # timeout is in seconds and enforced by the server through statement_timeout
+    # with raw_json, json columns come back as their text instead of decoded
+    def execute(
+        self, query: str, params: tuple = None, timeout: float = None, raw_json: bool = False
+    ) -> list[tuple]:
+        for attempt in range(2):
+            with self.connection() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        if raw_json:
+                            psycopg2.extras.register_default_json(cur, loads=lambda text: text)
+                        if timeout is not None:
+                            # local to the transaction, the rollback on release resets it
+                            # 0 turns the limit off, also one set through the session settings
+                            milliseconds = max(int(timeout * 1000), 1) if timeout > 0 else 0
+                            cur.execute(
+                                "SELECT set_config('statement_timeout', %s, true)",
+                                (str(milliseconds),),
+                            )
+                        cur.execute(query, params)
+                        return cur.fetchall()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    # reconnect once if the server dropped the connection
+                    if not conn.closed or attempt == 1:
+                        raise
+                    logging.info("DBMS connection lost, reconnecting")
+                    # the other idle connections most likely went down with it
+                    self.close_all()
+
     # query the database
-    def query(self, query: str) -> dict:
+    def query(self, query: str, timeout: float = None) -> dict:
         logging.info(f"querying")
-        self.cur.execute(query)
+        res = self.execute(query, timeout=timeout)
         logging.info("query successful")
-        res = self.cur.fetchall()
         return res[0][0][0]
 
+    # the same as query for EXPLAIN (FORMAT json), but the plan is returned as undecoded JSON text
+    def query_text(self, query: str, timeout: float = None) -> str:
+        logging.info(f"querying")
+        res = self.execute(query, timeout=timeout, raw_json=True)
+        logging.info("query successful")
+        return res[0][0]
+
+    # cheap fingerprint of the planner statistics of the given relations
+    def stats_fingerprint(self, relations: list[str]) -> str:
+        rows = self.execute(
+            """
+            SELECT c.oid::regclass::text, c.reltuples, c.relpages,
+                   s.last_analyze, s.last_autoanalyze
+            FROM pg_class c
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE c.relname = ANY(%s)
+            ORDER BY 1
+            """,
+            (list(relations),),
+        )
+        return hashlib.sha1(repr(rows).encode()).hexdigest()
 
-# we filter out the all not useful attribute in the plan such as Startup Cost, Total Cost, etc.
-useful_attributes = [
-    "Node Type",
-    "Relation Name",
-    "Group Key",
-    "Sort Key",
-    "Sort Method",
-    "Join Type",
-    "Index Name",
-    "Index Cond",
-    "Hash Cond",
-    "Filter",
-    "Merge Cond",
-    "Recheck Cond",
-    "Join Filter",
-    "Partial Mode",
-]
+    # abort the statements currently running on the server, safe to call from another thread
+    # the cancelled connections are rolled back when they are released
+    def cancel(self) -> None:
+        with self.lock:
+            active = list(self.active)
+        for conn in active:
+            conn.cancel()
+
+    # close every connection in the pool
+    def close_all(self) -> None:
+        with self.lock:
+            for conn, _ in self.idle:
+                self.close(conn)
+            self.idle = []
 
 
 # get the categories of a node
@@ -179,78 +381,269 @@ def get_category(node_type: str) -> str:
 
 
 # get the node from the plan
-def get_node(plan: dict) -> dict:
-    # return a dictionary with only the useful attributes
-    node = {}
-    for key in useful_attributes:
-        node[key] = "None"
+def get_node(plan: dict) -> PlanNode:
+    # keep only the useful attributes
+    node = PlanNode()
     for key in plan.keys():
         if key in useful_attributes:
             node[key] = plan[key]
-    # output relations, order is not considered
-    node["Output Relations"] = set()
-    # input relations, order is considered for join and aggregate
-    node["Input Relations"] = []
     node["Category"] = get_category(node["Node Type"])
     return node
 
 
-# node from [0, global_node_cnt)
-global_node_cnt = 0
-
-
 # build tree given a QEP plan
-def get_tree(json_obj: dict) -> nx.DiGraph:
-    global global_node_cnt
-    global_node_cnt = 0
-    my_tree = nx.DiGraph()
-    _get_tree(json_obj["Plan"], my_tree)
+def get_tree(json_obj: dict) -> PlanTree:
+    # walked with an explicit stack instead of recursion, so deep plans do not hit the recursion limit
+    # and nothing is shared between two trees built at the same time
+    my_tree = PlanTree()
+    my_tree.info = {
+        key: value for key, value in json_obj.items() if key != "Plan" and is_scalar(value)
+    }
+    # (plan, parent id) of nodes still to add, or (plan, node id) of nodes whose children are all added
+    stack = [(json_obj["Plan"], -1, False)]
+    while stack:
+        cur_plan, node_id, children_added = stack.pop()
+        if children_added:
+            finish_node(my_tree, node_id, "Plans" not in cur_plan)
+            continue
+        # parse current node, ids are given in pre-order
+        cur_id = my_tree.add_node(get_node(cur_plan), node_id)
+        stack.append((cur_plan, cur_id, True))
+        for sub_node in reversed(cur_plan.get("Plans", [])):
+            stack.append((sub_node, cur_id, False))
     return my_tree
 
 
-# helper function for get_tree
-def _get_tree(cur_plan: dict, my_tree: nx.DiGraph) -> int:
-    global global_node_cnt
-    # parse current node
-    cur_id = global_node_cnt
-    global_node_cnt += 1
-    cur_node = get_node(cur_plan)  # new node and its ID
-    my_tree.add_node(cur_id, **cur_node)  # add to tree
-
-    if not "Plans" in cur_plan:  # return if it's a leaf
+def is_scalar(value) -> bool:
+    return not isinstance(value, (dict, list))
+
+
+class PlanTreeBuilder(object):
+    """Builds a PlanTree from JSON parse events, keeping only what the tree needs."""
+
+    def __init__(self):
+        self.tree = PlanTree()
+        # one frame per open JSON container: "top", "node", "plans", "value" or "skip"
+        self.frames = [["top", None]]
+        # what to do with the next value: ("plan",), ("node", node_id, key), ("info", key) or ("skip",)
+        self.target = None
+        # containers of the attribute value being built, outermost first
+        self.values = []
+
+    # event and value as given by ijson.basic_parse
+    def feed(self, event: str, value) -> None:
+        frame = self.frames[-1]
+        kind = frame[0]
+        if kind == "skip":
+            if event in ("start_map", "start_array"):
+                frame[1] += 1
+            elif event in ("end_map", "end_array"):
+                frame[1] -= 1
+                if frame[1] == 0:
+                    self.frames.pop()
+            return
+        if kind == "value":
+            self.feed_value(event, value)
+            return
+        if event == "map_key":
+            self.target = self.get_target(frame, value)
+            return
+        if event in ("end_map", "end_array"):
+            self.frames.pop()
+            if kind == "node":
+                finish_node(self.tree, frame[1], not frame[2])
+            return
+        target, self.target = self.target, None
+        if kind == "plans" or (target is not None and target[0] == "plan"):
+            if event != "start_map":
+                raise ValueError(f"expected a plan node, got {event}")
+            parent = frame[1] if kind == "plans" else -1
+            node_id = self.tree.add_node(PlanNode(), parent)
+            # [kind, node id, has children]
+            self.frames.append(["node", node_id, False])
+            return
+        if target is None or target[0] in ("info", "skip") and event.startswith("start_"):
+            # outside of the plan, e.g. the list around it, or a value nobody needs
+            if event.startswith("start_"):
+                self.frames.append(["skip", 1] if target is not None else ["top", None])
+            return
+        if target[0] == "plans":
+            self.frames.append(["plans", target[1]])
+            return
+        self.values = []
+        self.frames.append(["value", target])
+        self.feed_value(event, value)
+
+    # where the value of key in the current object goes
+    def get_target(self, frame: list, key: str) -> tuple:
+        kind = frame[0]
+        if kind == "top":
+            if key == "Plan":
+                return ("plan",)
+            return ("info", key)
+        if key == "Plans":
+            frame[2] = True
+            return ("plans", frame[1])
+        if key in useful_attributes:
+            return ("node", frame[1], key)
+        return ("skip",)
+
+    # build an attribute value, which can be a list of keys or, rarely, something nested
+    def feed_value(self, event: str, value) -> None:
+        if event == "map_key":
+            self.values[-1][1] = value
+            return
+        if event == "start_map":
+            self.values.append([{}, None])
+            return
+        if event == "start_array":
+            self.values.append([[], None])
+            return
+        if event in ("end_map", "end_array"):
+            value = self.values.pop()[0]
+        if self.values:
+            container, key = self.values[-1]
+            if isinstance(container, list):
+                container.append(value)
+            else:
+                container[key] = value
+            return
+        # the value is complete
+        target = self.frames.pop()[1]
+        if target[0] == "node":
+            node = self.tree.nodes[target[1]]
+            node[target[2]] = value
+            if target[2] == "Node Type":
+                node["Category"] = get_category(value)
+        elif target[0] == "info":
+            self.tree.info[target[1]] = value
+
+
+class TextReader(object):
+    """File-like view of a str that hands out UTF-8 bytes a chunk at a time."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = len(self.text) - self.pos
+        chunk = self.text[self.pos : self.pos + size]
+        self.pos += len(chunk)
+        return chunk.encode()
+
+
+# build the tree straight from the JSON text of EXPLAIN (FORMAT json)
+def get_tree_from_text(text) -> PlanTree:
+    if ijson is not None:
+        # nodes are added while the text is parsed, the decoded document is never held in full
+        # ijson reads bytes, a str given as a whole would be copied into a much larger buffer first
+        builder = PlanTreeBuilder()
+        source = TextReader(text) if isinstance(text, str) else text
+        for event, value in ijson.basic_parse(source, use_float=True):
+            builder.feed(event, value)
+        return builder.tree
+    json_obj = json_loads(text)
+    if isinstance(json_obj, list):
+        # EXPLAIN returns a list with a single entry
+        json_obj = json_obj[0]
+    return get_tree(json_obj)
+
+
+# get the names of all the relations a QEP plan reads
+def get_plan_relations(json_obj: dict) -> list[str]:
+    relations = set()
+    plans = [json_obj["Plan"]]
+    while plans:
+        plan = plans.pop()
+        if "Relation Name" in plan:
+            relations.add(plan["Relation Name"])
+        plans.extend(plan.get("Plans", []))
+    return sorted(relations)
+
+
+# the same from the JSON text of a plan, without decoding it
+def get_plan_text_relations(text: str) -> list[str]:
+    # an unescaped quote only ends a JSON string, so this cannot match inside a value
+    relations = set()
+    for name in re.findall(r'"Relation Name"\s*:\s*("(?:[^"\\]|\\.)*")', text):
+        relations.add(json.loads(name))
+    return sorted(relations)
+
+
+# helper function for get_tree, fills in the relations of a node once all of its children are in the tree
+def finish_node(my_tree: PlanTree, cur_id: int, is_leaf: bool) -> None:
+    cur_node = my_tree.nodes[cur_id]
+    if is_leaf:  # it's a leaf
         if cur_node["Relation Name"] != "None":  # the leaf might be
             cur_node["Input Relations"].append({cur_node["Relation Name"]})
             cur_node["Output Relations"].add(cur_node["Relation Name"])
-        return cur_id
+        set_subtree_hash(my_tree, cur_id)
+        return
 
-    # get all its children and parse them
-    for sub_node in cur_plan["Plans"]:
-        child_id = _get_tree(sub_node, my_tree)
+    # collect the relations of its children
+    for child_id in my_tree.successors(cur_id):
         child_output = my_tree.nodes[child_id]["Output Relations"]
         if len(child_output) != 0:
             cur_node["Input Relations"].append(child_output)
             cur_node["Output Relations"].update(
                 my_tree.nodes[child_id]["Output Relations"]
             )
-        my_tree.add_edge(cur_id, child_id)
 
     # if the node is not leaf but its child doesn't have any relation (e.g. bitmap index scan)
     if len(cur_node["Input Relations"]) == 0 and "Relation Name" in cur_node.keys():
         cur_node["Input Relations"].append({cur_node["Relation Name"]})
         cur_node["Output Relations"].add(cur_node["Relation Name"])
-    return cur_id
+    set_subtree_hash(my_tree, cur_id)
+
+
+# turn a node attribute into plain JSON with a fixed order, so it hashes the same in every process
+def canonicalize(value):
+    if isinstance(value, dict):
+        return {key: canonicalize(item) for key, item in value.items()}
+    if isinstance(value, (set, frozenset)):
+        items = [canonicalize(item) for item in value]
+        if all(isinstance(item, str) for item in items):
+            # relation names, the common case, sort without encoding each one
+            return {"set": sorted(items)}
+        return {"set": sorted(items, key=lambda item: json.dumps(item, sort_keys=True))}
+    if isinstance(value, (list, tuple)):
+        return [canonicalize(item) for item in value]
+    return value
+
+
+# relations are collected from the children, whose hashes are already part of the content,
+# hashing them again at every node would take time growing with the square of the plan depth
+unhashed_attributes = ("Input Relations", "Output Relations")
+
+
+# Merkle hash of the subtree under node_id, computed once all of its children are in the tree
+def set_subtree_hash(my_tree: PlanTree, node_id: int) -> None:
+    node = {
+        key: value
+        for key, value in my_tree.nodes[node_id].items()
+        if key not in unhashed_attributes
+    }
+    content = json.dumps(canonicalize(node), sort_keys=True, default=str)
+    size = 1
+    for child_id in my_tree.successors(node_id):
+        content += my_tree.subtree_hash[child_id]
+        size += my_tree.subtree_size[child_id]
+    my_tree.subtree_hash[node_id] = hashlib.sha1(content.encode()).hexdigest()
+    my_tree.subtree_size[node_id] = size
 
 
 # explain the tree
-def explain_tree(tree: nx.DiGraph) -> str:
-    temp = _explain_tree(tree, 0)
+def explain_tree(tree: PlanTree) -> str:
+    temp = _explain_tree(tree)
     ret = ""
     for n, output in enumerate(temp):
         ret += f"{n}. {output}\n"
     return ret
 
 
-def explain_node(node: dict) -> str:
+def explain_node(node: PlanNode) -> str:
     ret = f"""PERFORM {node["Node Type"]} AND OUTPUTS: {node["Output Relations"]}"""
     first = True
     for attri in useful_attributes:
@@ -265,43 +658,177 @@ def explain_node(node: dict) -> str:
 
 
 # helper function for explain_tree
-def _explain_tree(tree: nx.DiGraph, cur: int) -> list:
-    # post order traversal
-    ret = []
-    ret.append(explain_node(tree.nodes[cur]))
-    for child in list(tree.neighbors(cur)):
-        ret.extend(_explain_tree(tree, child))
-    return ret
+def _explain_tree(tree: PlanTree) -> list:
+    # pre order traversal, node ids are already in pre-order
+    return [explain_node(node) for node in tree.nodes]
+
+
+# turn a node attribute into a hashable value with the same equality
+def freeze(value):
+    if isinstance(value, dict):
+        return frozenset((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        # the items of a set are hashable already, e.g. the relation names of Output Relations
+        return frozenset(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+# hashable fingerprint of a node, two nodes are equal exactly when their fingerprints are
+def get_node_fingerprint(node: PlanNode) -> frozenset:
+    return frozenset((key, freeze(value)) for key, value in node.items())
+
+
+# match identical subtrees of two trees as a whole, largest first
+def get_same_subtrees(tree1: PlanTree, tree2: PlanTree, pattern_id: int) -> int:
+    # node ids are given in pre-order, so the subtree under a root of size n is ids [root, root + n)
+    # and two identical subtrees line up id by id
+    hashes1, sizes1 = tree1.subtree_hash, tree1.subtree_size
+    hashes2 = tree2.subtree_hash
+    candidates = {}
+    for root2 in range(len(tree2)):
+        if tree2.pattern_id[root2] is None:
+            candidates.setdefault(hashes2[root2], deque()).append(root2)
+    # once a subtree is matched nothing inside it can start a larger match
+    for root1 in sorted(range(len(tree1)), key=lambda node_id: -sizes1[node_id]):
+        if tree1.pattern_id[root1] is not None:
+            continue
+        matches = candidates.get(hashes1[root1])
+        while matches and tree2.pattern_id[matches[0]] is not None:
+            matches.popleft()
+        if not matches:
+            continue
+        root2 = matches.popleft()
+        size = sizes1[root1]
+        for offset in range(size):
+            tree1.pattern_id[root1 + offset] = pattern_id
+            tree2.pattern_id[root2 + offset] = pattern_id
+            pattern_id += 1
+        if size > 1:
+            tree1.shared_subtrees.append((root1, root2, size))
+            tree2.shared_subtrees.append((root2, root1, size))
+    return pattern_id
 
 
 # get the same pattern in two trees
-def get_same_pattern(tree1: nx.DiGraph, tree2: nx.DiGraph) -> None:
+def get_same_pattern(tree1: PlanTree, tree2: PlanTree) -> None:
     # find the same nodes in two trees, and give the same pattern_id to all the nodes in the these subtree
-    pattern_id = 0
-    for node_id1, node1 in tree1.nodes.data():
-        if "pattern_id" in node1.keys():
+    # identical subtrees are paired first, then each remaining node of tree1 is paired with
+    # the first unmatched equal node of tree2, found through a hash index
+    pattern_id = get_same_subtrees(tree1, tree2, 0)
+    candidates = {}
+    for node_id2, node2 in enumerate(tree2.nodes):
+        if tree2.pattern_id[node_id2] is not None:
             # we have already found the pattern for this subtree, so we can skip it
             continue
-        for node_id2, node2 in tree2.nodes.data():
-            if "pattern_id" in node2.keys():
-                # we have already found the pattern for this subtree, so we can skip it
-                continue
-            if node1 == node2:
-                # inplace update
-                tree1.nodes[node_id1]["pattern_id"] = pattern_id
-                tree2.nodes[node_id2]["pattern_id"] = pattern_id
-                pattern_id += 1
+        candidates.setdefault(get_node_fingerprint(node2), deque()).append(node_id2)
+    for node_id1, node1 in enumerate(tree1.nodes):
+        if tree1.pattern_id[node_id1] is not None:
+            # we have already found the pattern for this subtree, so we can skip it
+            continue
+        matches = candidates.get(get_node_fingerprint(node1))
+        if matches:
+            node_id2 = matches.popleft()
+            # inplace update
+            tree1.pattern_id[node_id1] = pattern_id
+            tree2.pattern_id[node_id2] = pattern_id
+            pattern_id += 1
 
 
 # get the difference nodes in two trees
-def get_diff_nodes(tree: nx.DiGraph) -> list[dict]:
+def get_diff_nodes(tree: PlanTree) -> list[PlanNode]:
+    # shared subtrees are skipped as a whole
+    shared_sizes = {root: size for root, _, size in tree.shared_subtrees}
     diff_nodes = []
-    for _, node in tree.nodes.data():
-        if "pattern_id" not in node.keys():
-            diff_nodes.append(node)
+    node_id = 0
+    while node_id < len(tree):
+        if node_id in shared_sizes:
+            node_id += shared_sizes[node_id]
+            continue
+        if tree.pattern_id[node_id] is None:
+            diff_nodes.append(tree.nodes[node_id])
+        node_id += 1
     return diff_nodes
 
 
+# list the identical subtrees of two trees
+def get_shared_subtree_difference(tree1: PlanTree, tree2: PlanTree) -> str:
+    ret = """\
+Shared subtrees:
+"""
+    shared = sorted(tree1.shared_subtrees)
+    if len(shared) == 0:
+        ret += """\
+    None
+"""
+    for n, (root1, root2, size) in enumerate(shared):
+        node = tree1.nodes[root1]
+        ret += f"""\
+    {n + 1}. {node["Node Type"]} ON {node["Output Relations"]}, {size} nodes (QEP1 node {root1}, QEP2 node {root2})
+"""
+    return ret
+
+
+# list the minimum cost edits turning the first tree into the second one
+def get_edit_script_difference(tree1: PlanTree, tree2: PlanTree) -> str:
+    # imported on first use, numpy is not needed before there is something to compare
+    from tree_edit import get_edit_script
+
+    distance, script = get_edit_script(tree1, tree2, get_node_fingerprint)
+    ret = f"""\
+Plan edit distance: {distance:g}
+"""
+    edits = [edit for edit in script if edit[0] != "match"]
+    for n, (op, node_id1, node_id2) in enumerate(edits):
+        if op == "delete":
+            node = tree1.nodes[node_id1]
+            ret += f"""\
+    {n + 1}. Remove {node["Node Type"]} ON {node["Output Relations"]} (QEP1 node {node_id1})
+"""
+        elif op == "insert":
+            node = tree2.nodes[node_id2]
+            ret += f"""\
+    {n + 1}. Add {node["Node Type"]} ON {node["Output Relations"]} (QEP2 node {node_id2})
+"""
+        else:
+            node1, node2 = tree1.nodes[node_id1], tree2.nodes[node_id2]
+            ret += f"""\
+    {n + 1}. Change {node1["Node Type"]} ON {node1["Output Relations"]} (QEP1 node {node_id1}) to {node2["Node Type"]} ON {node2["Output Relations"]} (QEP2 node {node_id2})
+"""
+    return ret
+
+
+# pair the nodes of a and b with the same key in a single pass, each node of a takes the first unmatched node of b
+def match_nodes(a: list, b: list, get_key) -> tuple[list, list, list]:
+    candidates = {}
+    for b_id, node_b in enumerate(b):
+        candidates.setdefault(get_key(node_b), deque()).append(b_id)
+    matched = []
+    unmatched_a = []
+    matched_b = set()
+    for node_a in a:
+        b_ids = candidates.get(get_key(node_a))
+        if b_ids:
+            b_id = b_ids.popleft()
+            matched_b.add(b_id)
+            matched.append((node_a, b[b_id]))
+        else:
+            unmatched_a.append(node_a)
+    unmatched_b = [node_b for b_id, node_b in enumerate(b) if b_id not in matched_b]
+    return matched, unmatched_a, unmatched_b
+
+
+# join and scan nodes are matched on their output relations
+def get_output_relations_key(node: dict) -> frozenset:
+    return frozenset(node["Output Relations"])
+
+
+# other nodes are matched on their output relations and node type
+def get_other_key(node: dict) -> tuple:
+    return node["Node Type"], frozenset(node["Output Relations"])
+
+
 # get the join difference between two trees
 def get_join_difference(a: list, b: list):
     # input nodes differnce are one or more of the following:
@@ -310,77 +837,60 @@ def get_join_difference(a: list, b: list):
     # 3. input relations difference
     join_diff = []
     # match those with same output relations
-    done = False
     join_diff.append(
         f"""\
 Matched join difference:\
 """
     )
+    matched, a, b = match_nodes(a, b, get_output_relations_key)
     cnt = 0
-    while not done:
-        done = True
-        remove_a = []
-        remove_b = []
-        cur_diff = ""
-        for a_id, node_a in enumerate(a):
-            for b_id, node_b in enumerate(b):
-                # match those with same output relations
-                if node_a["Output Relations"] != node_b["Output Relations"]:
-                    continue
-                cnt += 1
-                cur_diff = f"""
+    cur_diff = ""
+    for node_a, node_b in matched:
+        cnt += 1
+        cur_diff = f"""
     Matched join diff {cnt}:\
 """
-                done = False
-                remove_a.append(a_id)
-                remove_b.append(b_id)
-                for attributes in useful_attributes:
-                    if (
-                        attributes == "Input Relations"
-                        or attributes == "Output Relations"
-                    ):
-                        continue
-                    if (
-                        attributes in node_a.keys()
-                        and attributes in node_b.keys()
-                        and node_a[attributes] != node_b[attributes]
-                    ):
-                        cur_diff += f"""
+        for attributes in useful_attributes:
+            if (
+                attributes == "Input Relations"
+                or attributes == "Output Relations"
+            ):
+                continue
+            if (
+                attributes in node_a.keys()
+                and attributes in node_b.keys()
+                and node_a[attributes] != node_b[attributes]
+            ):
+                cur_diff += f"""
         {attributes} difference:
             QEP1: {node_a[attributes]}
             QEP2: {node_b[attributes]}
 """
-                node_a_left = node_a["Input Relations"][0]
-                node_a_right = node_a["Input Relations"][1]
-                node_b_left = node_b["Input Relations"][0]
-                node_b_right = node_b["Input Relations"][1]
+        node_a_left = node_a["Input Relations"][0]
+        node_a_right = node_a["Input Relations"][1]
+        node_b_left = node_b["Input Relations"][0]
+        node_b_right = node_b["Input Relations"][1]
 
-                node_a_input_alphabetical_order = sorted(
-                    [sorted(list(s)) for s in node_a["Input Relations"]]
-                )
-                node_b_input_alphabetical_order = sorted(
-                    [sorted(list(s)) for s in node_b["Input Relations"]]
-                )
+        node_a_input_alphabetical_order = sorted(
+            [sorted(list(s)) for s in node_a["Input Relations"]]
+        )
+        node_b_input_alphabetical_order = sorted(
+            [sorted(list(s)) for s in node_b["Input Relations"]]
+        )
 
-                if node_a_input_alphabetical_order == node_b_input_alphabetical_order:
-                    cur_diff += f"""
+        if node_a_input_alphabetical_order == node_b_input_alphabetical_order:
+            cur_diff += f"""
         join ORDER difference:
             QEP1: {node_a["Node Type"]}: {node_a_left} X {node_a_right}
             QEP2: {node_b["Node Type"]}: {node_b_left} X {node_b_right}
 """
-                else:
-                    cur_diff += f"""
+        else:
+            cur_diff += f"""
         join RELATION difference:
             QEP1: {node_a["Node Type"]}: {node_a_left} X {node_a_right}
             QEP2: {node_b["Node Type"]}: {node_b_left} X {node_b_right}
 """
-                join_diff.append(cur_diff)
-        # remove the matched nodes
-        for i in sorted(remove_a, reverse=True):
-            a.pop(i)
-        for i in sorted(remove_b, reverse=True):
-            b.pop(i)
-    # out of while
+        join_diff.append(cur_diff)
     if cnt == 0:
         cur_diff += """\
     None
@@ -430,57 +940,40 @@ Unmatched join difference:\
 def get_scan_difference(a: list, b: list) -> list[str]:
     scan_diff = []
     # match those with same output relations
-    done = False
     scan_diff.append(
         f"""\
 Matched scan difference:\
 """
     )
+    matched, a, b = match_nodes(a, b, get_output_relations_key)
     cnt = 0
-    while not done:
-        done = True
-        remove_a = []
-        remove_b = []
-        cur_diff = ""
-        for a_id, node_a in enumerate(a):
-            for b_id, node_b in enumerate(b):
-                # match those with same output relations
-                if node_a["Output Relations"] != node_b["Output Relations"]:
-                    continue
-                cnt += 1
-                cur_diff = f"""
+    cur_diff = ""
+    for node_a, node_b in matched:
+        cnt += 1
+        cur_diff = f"""
     Matched scan diff {cnt}:\
 """
-                done = False
-                remove_a.append(a_id)
-                remove_b.append(b_id)
-                # for scan node with same output, only node type is different
-                cur_diff += f"""
+        # for scan node with same output, only node type is different
+        cur_diff += f"""
         On relation: {node_a["Output Relations"]}\
 """
-                for attributes in useful_attributes:
-                    if (
-                        attributes == "Input Relations"
-                        or attributes == "Output Relations"
-                    ):
-                        continue
-                    if (
-                        attributes in node_a.keys()
-                        and attributes in node_b.keys()
-                        and node_a[attributes] != node_b[attributes]
-                    ):
-                        cur_diff += f"""
+        for attributes in useful_attributes:
+            if (
+                attributes == "Input Relations"
+                or attributes == "Output Relations"
+            ):
+                continue
+            if (
+                attributes in node_a.keys()
+                and attributes in node_b.keys()
+                and node_a[attributes] != node_b[attributes]
+            ):
+                cur_diff += f"""
             {attributes} difference:
                 QEP1: {node_a[attributes]}
                 QEP2: {node_b[attributes]}
 """
-                scan_diff.append(cur_diff)
-        # remove the matched nodes
-        for i in sorted(remove_a, reverse=True):
-            a.pop(i)
-        for i in sorted(remove_b, reverse=True):
-            b.pop(i)
-    # out of while
+        scan_diff.append(cur_diff)
     if cnt == 0:
         cur_diff += """\
     None
@@ -526,59 +1019,38 @@ Unmatched scan difference:
 # get the difference of other nodes
 def get_other_difference(a: list, b: list):
     other_diff = []
-    # match those with same output relations
-    done = False
+    # match those with same output relations and node type
     other_diff.append(
         f"""\
 Matched other difference:\
 """
     )
+    matched, a, b = match_nodes(a, b, get_other_key)
     cnt = 0
-    while not done:
-        done = True
-        remove_a = []
-        remove_b = []
-        cur_diff = ""
-        for a_id, node_a in enumerate(a):
-            for b_id, node_b in enumerate(b):
-                # match those with same output relations
-                if (
-                    node_a["Output Relations"] != node_b["Output Relations"]
-                    or node_a["Node Type"] != node_b["Node Type"]
-                ):
-                    continue
-
-                cnt += 1
-                done = False
-                remove_a.append(a_id)
-                remove_b.append(b_id)
-                # for scan node with same output, only node type is different
-                cur_diff = f"""
+    cur_diff = ""
+    for node_a, node_b in matched:
+        cnt += 1
+        # for scan node with same output, only node type is different
+        cur_diff = f"""
     Matched other diff {cnt} of {node_a["Node Type"]} on relation {node_a["Output Relations"]}:\
 """
-                for attributes in useful_attributes:
-                    if (
-                        attributes == "Input Relations"
-                        or attributes == "Output Relations"
-                    ):
-                        continue
-                    if (
-                        attributes in node_a.keys()
-                        and attributes in node_b.keys()
-                        and node_a[attributes] != node_b[attributes]
-                    ):
-                        cur_diff += f"""
+        for attributes in useful_attributes:
+            if (
+                attributes == "Input Relations"
+                or attributes == "Output Relations"
+            ):
+                continue
+            if (
+                attributes in node_a.keys()
+                and attributes in node_b.keys()
+                and node_a[attributes] != node_b[attributes]
+            ):
+                cur_diff += f"""
         {attributes} difference:
             QEP1: {node_a[attributes]}
             QEP2: {node_b[attributes]}
 """
-                other_diff.append(cur_diff)
-        # remove the matched nodes
-        for i in sorted(remove_a, reverse=True):
-            a.pop(i)
-        for i in sorted(remove_b, reverse=True):
-            b.pop(i)
-    # out of while
+        other_diff.append(cur_diff)
     if cnt == 0:
         cur_diff += """\
     None\n"""
@@ -656,15 +1128,24 @@ def get_tree_difference(diff_a: dict, diff_b: dict):
 
 
 # get the difference of two trees
-def get_qep_difference(tree1: nx.DiGraph, tree2: nx.DiGraph) -> tuple[str]:
+# edit_script adds the minimum cost edits between the trees, which takes time and memory
+# growing with the product of both tree sizes, so it is only done when asked for
+def get_qep_difference(tree1: PlanTree, tree2: PlanTree, edit_script: bool = False) -> tuple[str]:
     get_same_pattern(tree1, tree2)
     diff_a = get_diff_nodes(tree1)
     diff_b = get_diff_nodes(tree2)
-    return get_tree_difference(diff_a, diff_b)
+    parts = [get_shared_subtree_difference(tree1, tree2)]
+    if edit_script:
+        parts.append(get_edit_script_difference(tree1, tree2))
+    parts.append(get_tree_difference(diff_a, diff_b))
+    return "-------------------------------------------------------\n".join(parts)
 
 
 # get the difference of two queries
 def get_query_difference(query1: str, query2: str) -> tuple[str]:
+    # imported on first use to keep it out of the start-up time
+    import sqlparse
+
     # Convert the parsed SQL queries into a string representation
     query1 = query1.strip()
     query2 = query2.strip()
@@ -702,45 +1183,527 @@ def get_query_difference(query1: str, query2: str) -> tuple[str]:
     return formatted_sql1, formatted_sql2, differences, colors
 
 
+# normalize a query so that formatting and comments do not change its cache key
+# strip_whitespace only collapses whitespace between tokens, spaces inside string literals are kept
+def normalize_query(query: str) -> str:
+    import sqlparse
+
+    formatted = sqlparse.format(
+        query, strip_comments=True, keyword_case="upper", strip_whitespace=True
+    )
+    return formatted.rstrip(";").strip()
+
+
+class PlanCache(object):
+    """size-bounded LRU cache of query plans, keyed by normalized query"""
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        # key -> (relations, stats fingerprint, plan), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> tuple:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, relations: list[str], fingerprint: str, plan: str) -> None:
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (relations, fingerprint, plan)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key: str = None) -> None:
+        # drop one entry, or everything when no key is given
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+class PlanStore(object):
+    """SQLite backed store for fetched plans and comparison results that survives restarts"""
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 7 * 24 * 3600,
+        max_bytes: int = 256 * 1024 * 1024,
+    ):
+        # entries older than ttl seconds are dropped, least recently used ones go first past max_bytes
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # evict sums the sizes of every entry, so it only runs once this many puts or bytes were added
+        # since the last time, the store may go over max_bytes by up to that much in between
+        self.evict_puts = 64
+        self.evict_bytes = max_bytes // 16
+        self.puts_since_evict = 0
+        self.bytes_since_evict = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # batch workers share the file, a writer waits up to timeout seconds for another one to finish
+        # and with the write-ahead log readers do not block writers at all
+        self.conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.lock, self.conn:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS plans (
+                    server TEXT NOT NULL,
+                    query_key TEXT NOT NULL,
+                    relations TEXT NOT NULL,
+                    stats_fingerprint TEXT NOT NULL,
+                    plan TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    PRIMARY KEY (server, query_key)
+                );
+                CREATE TABLE IF NOT EXISTS comparisons (
+                    server TEXT NOT NULL,
+                    comparison_key TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    PRIMARY KEY (server, comparison_key)
+                );
+                CREATE INDEX IF NOT EXISTS plans_accessed ON plans (accessed);
+                CREATE INDEX IF NOT EXISTS comparisons_accessed ON comparisons (accessed);
+                """
+            )
+
+    # reopen the same file when sent to another process, e.g. a batch worker
+    def __reduce__(self):
+        return (PlanStore, (self.path, self.ttl, self.max_bytes))
+
+    def get_plan(self, server: str, query_key: str) -> tuple:
+        # returns (relations, stats fingerprint, plan) or None
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT relations, stats_fingerprint, plan FROM plans"
+                " WHERE server = ? AND query_key = ? AND created >= ?",
+                (server, query_key, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE plans SET accessed = ? WHERE server = ? AND query_key = ?",
+                (time.time(), server, query_key),
+            )
+        return json.loads(row[0]), row[1], row[2]
+
+    def put_plan(
+        self, server: str, query_key: str, relations: list[str], fingerprint: str, plan: str
+    ) -> None:
+        # plans are stored as the JSON text EXPLAIN returned
+        plan_text = plan
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    server,
+                    query_key,
+                    json.dumps(relations),
+                    fingerprint,
+                    plan_text,
+                    now,
+                    now,
+                    len(plan_text),
+                ),
+            )
+        self.added(len(plan_text))
+
+    def get_comparison(self, server: str, comparison_key: str) -> tuple:
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT result FROM comparisons"
+                " WHERE server = ? AND comparison_key = ? AND created >= ?",
+                (server, comparison_key, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE comparisons SET accessed = ? WHERE server = ? AND comparison_key = ?",
+                (time.time(), server, comparison_key),
+            )
+        return tuple(json.loads(row[0]))
+
+    def put_comparison(self, server: str, comparison_key: str, result: tuple) -> None:
+        result_text = json.dumps(result)
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO comparisons VALUES (?, ?, ?, ?, ?, ?)",
+                (server, comparison_key, result_text, now, now, len(result_text)),
+            )
+        self.added(len(result_text))
+
+    # count a put and evict once enough was added
+    def added(self, size: int) -> None:
+        with self.lock:
+            self.puts_since_evict += 1
+            self.bytes_since_evict += size
+            due = (
+                self.puts_since_evict >= self.evict_puts
+                or self.bytes_since_evict >= self.evict_bytes
+            )
+        if due:
+            self.evict()
+
+    # drop expired entries, then the least recently used ones until the store fits in max_bytes
+    def evict(self) -> None:
+        with self.lock, self.conn:
+            self.puts_since_evict = 0
+            self.bytes_since_evict = 0
+            expired = time.time() - self.ttl
+            self.conn.execute("DELETE FROM plans WHERE created < ?", (expired,))
+            self.conn.execute("DELETE FROM comparisons WHERE created < ?", (expired,))
+            total = self.conn.execute(
+                "SELECT (SELECT COALESCE(SUM(size), 0) FROM plans)"
+                " + (SELECT COALESCE(SUM(size), 0) FROM comparisons)"
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self.conn.execute(
+                "SELECT 'plans', rowid, size, accessed FROM plans"
+                " UNION ALL SELECT 'comparisons', rowid, size, accessed FROM comparisons"
+                " ORDER BY accessed"
+            ).fetchall()
+            for table, rowid, size, _ in rows:
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+                total -= size
+
+    def invalidate(self) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM plans")
+            self.conn.execute("DELETE FROM comparisons")
+
+
 # Controller class
 class Control(object):
     """class that handles the interaction between GUI and DB_Manager"""
 
-    def __init__(self, host: str, database: str, user: str, password: str, port: int):
+    def __init__(
+        self,
+        host: str = None,
+        database: str = None,
+        user: str = None,
+        password: str = None,
+        port: int = None,
+        min_connections: int = 2,
+        max_connections: int = 4,
+        session_settings: dict = None,
+        plan_cache_size: int = 128,
+        plan_store: PlanStore = None,
+        analyze: bool = True,
+        statement_timeout: float = None,
+        tracing: bool = False,
+        trace_file: str = None,
+        plan_source: PlanSource = None,
+        edit_script: bool = False,
+    ):
         super(Control, self).__init__()
-        self.db = DatabaseManager(host, database, user, password, port)
+        # plans come from plan_source when it is given, e.g. saved EXPLAIN files,
+        # and no database is connected to, the queries are then the names the source knows the plans by
+        self.plan_source = plan_source
+        self.db = None
+        if plan_source is None:
+            # the pool keeps at least two connections so both plans can be fetched at the same time
+            self.db = DatabaseManager(
+                host,
+                database,
+                user,
+                password,
+                port,
+                min_connections=min_connections,
+                max_connections=max(max_connections, 2),
+                session_settings=session_settings,
+            )
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.cancelled = threading.Event()
+        self.plan_cache = PlanCache(plan_cache_size)
+        # optional on-disk store consulted after the in-memory cache
+        self.plan_store = plan_store
+        # trimming the store sums every entry, the dialog creates the Control on a background thread
+        # so this is kept off start-up
+        if plan_store is not None:
+            plan_store.evict()
+        # EXPLAIN ANALYZE executes the queries, without it only the planner estimates are used
+        self.analyze = analyze
+        # seconds each EXPLAIN may run on the server, None for no limit
+        self.statement_timeout = statement_timeout
+        # extra seconds to wait for the server to honour the timeout before cancelling it ourselves
+        self.cancel_grace = 5.0
+        # time the stages of every comparison, the traces are logged as JSON and appended to trace_file if given
+        self.tracing = tracing or trace_file is not None
+        self.trace_file = trace_file
+        # also list the minimum cost edits between the plans, quadratic in the plan sizes
+        self.edit_script = edit_script
+
+    def cancel(self) -> None:
+        # stop the running comparison, the server statements are aborted as well
+        self.cancelled.set()
+        self.cancel_source()
+
+    # the database, or the plan source when there is none
+    def get_identity(self) -> str:
+        if self.db is not None:
+            return self.db.server_identity
+        return self.plan_source.identity
+
+    def cancel_source(self) -> None:
+        if self.db is not None:
+            self.db.cancel()
+        else:
+            self.plan_source.cancel()
+
+    def check_cancelled(self) -> None:
+        if self.cancelled.is_set():
+            raise ComparisonCancelled("comparison cancelled")
 
-    def add_explain_analyze(self, query: str) -> str:
+    def add_explain_analyze(self, query: str, analyze: bool = None) -> str:
         # give a prefix to the query such that we can get the query plan from the DB
-        return "EXPLAIN (ANALYZE true, FORMAT json) " + query
+        if analyze is None:
+            analyze = self.analyze
+        if analyze:
+            return "EXPLAIN (ANALYZE true, FORMAT json) " + query
+        return "EXPLAIN (FORMAT json) " + query
+
+    def fetch_plan(
+        self, query: str, analyze: bool = None, timeout: float = None, trace=null_trace
+    ) -> str:
+        # reuse the cached plan as long as the statistics of its relations did not change
+        # plans are kept as their JSON text, which is far smaller than the decoded document
+        if self.plan_source is not None:
+            # saved plans are read as they are, analyze and timeout do not apply to them
+            return self.plan_source.fetch_plan(query, trace)
+        statement = self.add_explain_analyze(query, analyze)
+        with trace.span("cache key"):
+            key = normalize_query(statement)
+        entry = self.plan_cache.get(key)
+        if entry is not None:
+            relations, fingerprint, plan = entry
+            with trace.span("stats check"):
+                fresh = self.db.stats_fingerprint(relations) == fingerprint
+            if fresh:
+                logging.info("plan cache hit")
+                trace.set(source="cache")
+                return plan
+            self.plan_cache.invalidate(key)
+        query_key = hashlib.sha1(key.encode()).hexdigest()
+        if self.plan_store is not None:
+            entry = self.plan_store.get_plan(self.db.server_identity, query_key)
+            if entry is not None:
+                relations, fingerprint, plan = entry
+                with trace.span("stats check"):
+                    fresh = self.db.stats_fingerprint(relations) == fingerprint
+                if fresh:
+                    logging.info("plan store hit")
+                    trace.set(source="store")
+                    self.plan_cache.put(key, relations, fingerprint, plan)
+                    return plan
+        trace.set(source="database")
+        # the round trip, the time the server itself reports is added once the plan is read
+        with trace.span("explain"):
+            plan = self.db.query_text(statement, timeout)
+        relations = get_plan_text_relations(plan)
+        with trace.span("stats check"):
+            fingerprint = self.db.stats_fingerprint(relations)
+        self.plan_cache.put(key, relations, fingerprint, plan)
+        if self.plan_store is not None:
+            self.plan_store.put_plan(
+                self.db.server_identity, query_key, relations, fingerprint, plan
+            )
+        return plan
+
+    def invalidate_plan_cache(self) -> None:
+        self.plan_cache.invalidate()
+        if self.plan_store is not None:
+            self.plan_store.invalidate()
+
+    # key of a comparison result, the same plans and queries always give the same differences
+    # the plans are keyed by the Merkle hash of their trees, which only covers what the differences are
+    # made from, so the same plans run again with EXPLAIN ANALYZE hit even though their timings changed
+    def get_comparison_key(
+        self, query1: str, query2: str, tree1: PlanTree, tree2: PlanTree
+    ) -> str:
+        content = json.dumps(
+            [query1, query2, tree1.subtree_hash[0], tree2.subtree_hash[0], self.edit_script]
+        )
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def fetch_plans(
+        self,
+        query1: str,
+        query2: str,
+        analyze: bool = None,
+        timeout: float = None,
+        trace=null_trace,
+    ) -> tuple[str, str]:
+        # run both EXPLAIN statements concurrently, each on its own pooled connection
+        if timeout is None:
+            timeout = self.statement_timeout
+        futures = [
+            self.executor.submit(
+                self.fetch_traced_plan, n + 1, trace.current(), trace, query, analyze, timeout
+            )
+            for n, query in enumerate((query1, query2))
+        ]
+        watchdog = timeout + self.cancel_grace if timeout else None
+        done, not_done = wait(futures, timeout=watchdog, return_when=FIRST_EXCEPTION)
+        if not_done:
+            # one of the plans failed or the server did not stop it in time,
+            # abort whatever is still running instead of waiting for it
+            self.cancel_source()
+            wait(not_done)
+            for future in done:
+                if future.exception() is not None:
+                    raise future.exception()
+        return futures[0].result(), futures[1].result()
+
+    # fetch_plan on an executor thread, in a span of its own under parent
+    def fetch_traced_plan(
+        self, n: int, parent, trace, query: str, analyze: bool, timeout: float
+    ) -> str:
+        with trace.span(f"plan {n}", parent):
+            return self.fetch_plan(query, analyze, timeout, trace)
+
+    # log the trace of a comparison as JSON, append it to the trace file and hand it to trace_ready
+    def finish_trace(self, trace: Trace, trace_ready=None) -> None:
+        trace.finish()
+        logging.getLogger(logger_name).info(trace.to_json())
+        if self.trace_file is not None:
+            try:
+                write_trace(trace, self.trace_file)
+            except OSError as e:
+                logging.error(f"could not write the trace to {self.trace_file}: {e}")
+        if trace_ready is not None:
+            trace_ready(trace)
 
     def generate_differences(
-        self, query1: str, query2: str, testing: int = None
+        self,
+        query1: str,
+        query2: str,
+        image_paths: tuple = None,
+        progress=None,
+        analyze: bool = None,
+        timeout: float = None,
+        trees_ready=None,
+        trace_ready=None,
+    ) -> tuple[str]:
+        # the trees are saved as png files to image_paths, or not at all when it is None
+        # trees_ready is an optional callback, called with both trees once their nodes are matched,
+        # e.g. to draw them with get_tree_tiles or get_tree_drawing
+        # progress is an optional callback, called with the name of each stage as it starts
+        # analyze and timeout override self.analyze and self.statement_timeout for this comparison only,
+        # a timeout of 0 means no limit and None keeps self.statement_timeout
+        # trace_ready is an optional callback, called with the Trace of the comparison when tracing is on,
+        # also when the comparison failed
+        if progress is None:
+            progress = lambda stage: None
+        if not self.tracing:
+            return self.get_differences(
+                query1, query2, image_paths, progress, analyze, timeout, trees_ready, null_trace
+            )
+        if self.plan_source is not None:
+            trace = Trace(source=self.plan_source.identity)
+        else:
+            trace = Trace(analyze=self.analyze if analyze is None else analyze)
+        try:
+            return self.get_differences(
+                query1, query2, image_paths, progress, analyze, timeout, trees_ready, trace
+            )
+        finally:
+            self.finish_trace(trace, trace_ready)
+
+    # the stages of generate_differences, each in a span of the trace
+    def get_differences(
+        self,
+        query1: str,
+        query2: str,
+        image_paths: tuple,
+        progress,
+        analyze: bool,
+        timeout: float,
+        trees_ready,
+        trace,
     ) -> tuple[str]:
+        self.cancelled.clear()
         # get the query plans
-        plan1_json = self.db.query(self.add_explain_analyze(query1))
-        plan2_json = self.db.query(self.add_explain_analyze(query2))
-        tree1 = get_tree(plan1_json)
-        tree2 = get_tree(plan2_json)
+        progress("plan fetch")
+        try:
+            with trace.span("plan fetch"):
+                plan1_text, plan2_text = self.fetch_plans(query1, query2, analyze, timeout, trace)
+        except psycopg2.extensions.QueryCanceledError:
+            # report a cancel from the user as such, anything else is a statement timeout
+            self.check_cancelled()
+            raise
+        self.check_cancelled()
+        progress("tree build")
+        with trace.span("tree build"):
+            tree1 = get_tree_from_text(plan1_text)
+            tree2 = get_tree_from_text(plan2_text)
+        if trace.enabled:
+            add_server_times(trace, [tree1, tree2])
+        if self.plan_source is not None:
+            # the queries named the plans, the differences are between the SQL they were made from
+            query1 = self.plan_source.get_query(query1, tree1)
+            query2 = self.plan_source.get_query(query2, tree2)
+        # a stored result is looked up as soon as the trees are built,
+        # the trees are still drawn on a hit since the images are not stored
+        result = None
+        if self.plan_store is not None:
+            with trace.span("store lookup"):
+                comparison_key = self.get_comparison_key(query1, query2, tree1, tree2)
+                result = self.plan_store.get_comparison(self.get_identity(), comparison_key)
+            if result is not None:
+                logging.info("comparison store hit")
+                trace.set(source="store")
+        self.check_cancelled()
         # plot the trees
-        if testing is not None:
-            draw_tree(tree1, tree2, testing)
-        else:
-            draw_tree(tree1, tree2)
-        # get tree explanations
-        tree1_explanation = explain_tree(tree1)
-        tree2_explanation = explain_tree(tree2)
-        # get tree differences
-        tree_diff_statement = get_qep_difference(tree1, tree2)
-        # get query differences
-        (
-            formatted_q1,
-            formatted_q2,
-            query_diff_strs,
-            query_diff_colors,
-        ) = get_query_difference(query1, query2)
+        progress("render")
+        with trace.span("render"):
+            if image_paths is not None:
+                draw_tree(tree1, tree2, image_paths)
+            if trees_ready is not None:
+                get_same_pattern(tree1, tree2)
+                trees_ready(tree1, tree2)
+        self.check_cancelled()
+        if result is not None:
+            return result
+        progress("diff")
+        with trace.span("diff"):
+            # get tree explanations
+            with trace.span("explain_tree"):
+                tree1_explanation = explain_tree(tree1)
+                tree2_explanation = explain_tree(tree2)
+            # get tree differences
+            with trace.span("get_qep_difference"):
+                tree_diff_statement = get_qep_difference(tree1, tree2, self.edit_script)
+            # get query differences
+            with trace.span("get_query_difference"):
+                (
+                    formatted_q1,
+                    formatted_q2,
+                    query_diff_strs,
+                    query_diff_colors,
+                ) = get_query_difference(query1, query2)
         logging.info("Finished")
-        return (
+        result = (
             formatted_q1,
             formatted_q2,
             tree1_explanation,
@@ -749,3 +1712,21 @@ class Control(object):
             query_diff_strs,
             query_diff_colors,
         )
+        if self.plan_store is not None:
+            self.plan_store.put_comparison(self.get_identity(), comparison_key, result)
+        return result
+
+
+# split the round trip of each EXPLAIN that went to the server into the time the server reports
+# for planning and executing the query, and the rest: the connection, the network and sending the plan
+def add_server_times(trace: Trace, trees: list[PlanTree]) -> None:
+    for n, tree in enumerate(trees):
+        span = trace.find("explain", parent=f"plan {n + 1}")
+        if span is None:
+            continue
+        milliseconds = [tree.info.get(name) for name in ("Planning Time", "Execution Time")]
+        milliseconds = [value for value in milliseconds if isinstance(value, (int, float))]
+        if not milliseconds:
+            continue
+        span.attributes["server_time"] = sum(milliseconds) / 1000
+        span.attributes["overhead"] = span.duration - span.attributes["server_time"]
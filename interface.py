@@ -1,5 +1,9 @@
+import math
 import os.path
-from explain import Control
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from explain import Control, ComparisonCancelled, get_tree_drawing, get_tree_tiles
+from render import start_render_pool, submit_tile
 import logging
 
 from PyQt6 import QtWidgets, QtCore
@@ -9,8 +13,11 @@ from PyQt6.QtCore import (
     QPoint,
     QPointF,
     pyqtSignal,
+    pyqtSlot,
     QEvent,
+    QObject,
     QSize,
+    QThread,
     QTimer,
 )
 from PyQt6.QtGui import (
@@ -33,6 +40,7 @@ from PyQt6.QtWidgets import (
     QGraphicsRectItem,
     QGraphicsLineItem,
     QGraphicsPolygonItem,
+    QGraphicsSimpleTextItem,
     QScrollArea,
 )
 
@@ -45,6 +53,85 @@ text_color_title = "#072a24"
 button_bg_color = "#7fb174"
 slider_handle_color = "#ddeee6"
 
+# status text shown for each stage reported by Control.generate_differences
+stage_messages = {
+    "plan fetch": "Fetching query plans...",
+    "tree build": "Building QEP trees...",
+    "render": "Drawing QEP trees...",
+    "diff": "Computing differences...",
+}
+
+
+class ComparisonWorker(QObject):
+    """runs Control.generate_differences on a background thread"""
+
+    progress = pyqtSignal(str)
+    # both trees as tile pyramids from get_tree_tiles, with the matplotlib renderer
+    images = pyqtSignal(object, object)
+    # both trees as returned by get_tree_drawing, with the qt renderer
+    drawings = pyqtSignal(object, object)
+    finished = pyqtSignal(tuple)
+    failed = pyqtSignal(object)
+    # the Trace of the comparison when tracing is on, before finished or failed
+    traced = pyqtSignal(object)
+
+    def __init__(
+        self, control, query1: str, query2: str, analyze: bool, timeout: float, renderer: str
+    ):
+        super().__init__()
+        self.control = control
+        self.query1 = query1
+        self.query2 = query2
+        self.analyze = analyze
+        self.timeout = timeout
+        self.renderer = renderer
+
+    def emitImages(self, tree1, tree2):
+        self.images.emit(*get_tree_tiles(tree1, tree2))
+
+    def emitDrawings(self, tree1, tree2):
+        self.drawings.emit(get_tree_drawing(tree1), get_tree_drawing(tree2))
+
+    @pyqtSlot()
+    def run(self):
+        # the trees are handed to the dialog in memory, no image files are written
+        try:
+            results = self.control.generate_differences(
+                self.query1,
+                self.query2,
+                progress=self.progress.emit,
+                analyze=self.analyze,
+                timeout=self.timeout,
+                trees_ready=self.emitDrawings if self.renderer == "qt" else self.emitImages,
+                trace_ready=self.traced.emit,
+            )
+        except Exception as e:
+            self.failed.emit(e)
+            return
+        self.finished.emit(results)
+
+
+class ConnectionWorker(QObject):
+    """creates the Control, and with it the DB connections, on a background thread"""
+
+    connected = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+    def __init__(self, control_args: tuple, control_options: dict):
+        super().__init__()
+        self.control_args = control_args
+        self.control_options = control_options
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            control = Control(*self.control_args, **self.control_options)
+        except Exception as e:
+            self.failed.emit(e)
+            return
+        self.connected.emit(control)
+
+
 # UI definition
 class Ui_Dialog(object):
     """Set QEP Image To First Query: setImgToViewerA(filepath:string)
@@ -59,7 +146,17 @@ class Ui_Dialog(object):
     TODO: modify onClickGetPlanButton
     """
 
-    def __init__(self, Dialog, host, database, user, password, port):
+    def __init__(
+        self,
+        Dialog,
+        host,
+        database,
+        user,
+        password,
+        port,
+        control_options=None,
+        renderer="matplotlib",
+    ):
         Dialog.setObjectName("ABC")
         Dialog.resize(1600, 800)
         Dialog.setMinimumSize(QtCore.QSize(800, 600))
@@ -123,7 +220,11 @@ class Ui_Dialog(object):
         self.setExplainA_UI(Dialog)
         self.two_Explain_HorLy.addLayout(self.explain_A_VerLy)
 
-        self.two_Explain_HorLy.addItem(spacer_between_queries)
+        # a layout deletes its items, so each row needs a spacer of its own
+        spacer_between_explains = QtWidgets.QSpacerItem(
+            40, 20, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Minimum
+        )
+        self.two_Explain_HorLy.addItem(spacer_between_explains)
 
         self.setExplainB_UI(Dialog)
         self.two_Explain_HorLy.addLayout(self.explain_B_VerLy)
@@ -158,9 +259,39 @@ class Ui_Dialog(object):
         self.retranslateUi(Dialog)
         QtCore.QMetaObject.connectSlotsByName(Dialog)
 
-        self.my_control = Control(host, database, user, password, port)
-        
+        # control_options are passed on to Control, e.g. pool size and session settings
+        self.control_args = (host, database, user, password, port)
+        self.control_options = control_options or {}
+        # set once the DB is connected, see connectDatabase
+        self.my_control = None
+        # Control's own defaults, shown before it exists
+        self.analyze_CheckBox.setChecked(self.control_options.get("analyze", True))
+        self.timeout_SpinBox.setValue(self.control_options.get("statement_timeout") or 0)
+        if self.control_options.get("plan_source") is not None:
+            # the inputs name saved plans, nothing is executed
+            self.textlabel_query_A.setText("Plan file 1:")
+            self.textlabel_query_B.setText("Plan file 2:")
+            self.getPlan_PushBtn.setText("Load QEP")
+            self.analyze_CheckBox.setEnabled(False)
+            self.timeout_SpinBox.setEnabled(False)
+        self.worker_thread = None
+        self.worker = None
+        # the Trace of the last comparison, shown in the status area when tracing is on
+        self.last_trace = None
+        self.connect_thread = None
+        self.connect_worker = None
+        # "matplotlib" shows the images drawn by draw_tree, "qt" draws the trees as scene items
+        self.renderer = renderer
+        if self.renderer != "qt":
+            start_render_pool()
+
         self.getPlan_PushBtn.clicked.connect(self.onClickGetPlanButton)
+        self.cancel_PushBtn.clicked.connect(self.onClickCancelButton)
+        # emitted when the window is closed as well
+        Dialog.finished.connect(self.onDialogClosed)
+
+        # the dialog is shown while the connections are being opened
+        self.connectDatabase()
 
     
 
@@ -357,7 +488,39 @@ class Ui_Dialog(object):
         self.setStyleSheetPushButton(self.getPlan_PushBtn)
         self.getPlan_PushBtn.setAutoFillBackground(True)
 
+        self.analyze_CheckBox = QtWidgets.QCheckBox(Dialog)
+        self.analyze_CheckBox.setObjectName("analyze_CheckBox")
+        self.setStyleSheetCheckBox(self.analyze_CheckBox)
+        self.getPlan_button_layout.addWidget(self.analyze_CheckBox)
+
+        self.timeout_label = QtWidgets.QLabel(Dialog)
+        self.timeout_label.setObjectName("timeout_label")
+        self.setStyleSheetInfoLabel(self.timeout_label)
+        self.getPlan_button_layout.addWidget(self.timeout_label)
+
+        # statement timeout in seconds, 0 means no limit, even when --statement-timeout gave one
+        self.timeout_SpinBox = QtWidgets.QDoubleSpinBox(Dialog)
+        self.timeout_SpinBox.setObjectName("timeout_SpinBox")
+        self.timeout_SpinBox.setDecimals(1)
+        self.timeout_SpinBox.setRange(0, 24 * 3600)
+        self.setStyleSheetSpinBox(self.timeout_SpinBox)
+        self.getPlan_button_layout.addWidget(self.timeout_SpinBox)
+
         self.getPlan_button_layout.addWidget(self.getPlan_PushBtn)
+
+        self.cancel_PushBtn = QtWidgets.QPushButton(Dialog)
+        self.cancel_PushBtn.setMinimumSize(QtCore.QSize(120, 30))
+        self.cancel_PushBtn.setMaximumSize(QtCore.QSize(120, 30))
+        self.cancel_PushBtn.setObjectName("cancel_PushBtn")
+        self.setStyleSheetPushButton(self.cancel_PushBtn)
+        self.cancel_PushBtn.setEnabled(False)
+        self.getPlan_button_layout.addWidget(self.cancel_PushBtn)
+
+        self.status_label = QtWidgets.QLabel(Dialog)
+        self.status_label.setObjectName("status_label")
+        self.status_label.setMinimumWidth(250)
+        self.setStyleSheetInfoLabel(self.status_label)
+        self.getPlan_button_layout.addWidget(self.status_label)
         self.getPlan_button_layout.addStretch()
         self.dialog_VerLy.addLayout(self.getPlan_button_layout)
 
@@ -388,6 +551,15 @@ class Ui_Dialog(object):
             )
         )
         self.getPlan_PushBtn.setText("Format query and get QEP")
+        self.cancel_PushBtn.setText("Cancel")
+        self.analyze_CheckBox.setText("EXPLAIN ANALYZE (executes the queries)")
+        self.timeout_label.setText("Timeout:")
+        self.timeout_SpinBox.setSuffix(" s")
+        self.timeout_SpinBox.setSpecialValueText("none")
+        self.timeout_SpinBox.setToolTip("Statement timeout applied on the server to each query")
+        self.analyze_CheckBox.setToolTip(
+            "Unchecked: compare the planner's estimated plans without running the queries"
+        )
 
     def setStyleSheetUI(self, Dialog):
         
@@ -473,6 +645,26 @@ class Ui_Dialog(object):
             }}
         """)
 
+    def setStyleSheetCheckBox(self, check_box):
+        check_box.setStyleSheet(f"""
+            QCheckBox {{
+                background-color: {app_bg_color};
+                color: {text_color_light_gray};
+                font-family: Arial;
+                font-size: 14px;
+            }}
+        """)
+
+    def setStyleSheetSpinBox(self, spin_box):
+        spin_box.setStyleSheet(f"""
+            QAbstractSpinBox {{
+                background-color: {textbox_bg_color_1};
+                color: {text_color_dark_gray};
+                font-family: Arial;
+                font-size: 14px;
+            }}
+        """)
+
     def setStyleSheetPushButton(self, button):
         
         button.setStyleSheet(f"""
@@ -575,26 +767,71 @@ class Ui_Dialog(object):
         self.imgViewer_B.show()
 
     def queryResults(self):
-        try:
-            query1, query2 = self.getQueryTexts()
-            (
-                formatted_q1,
-                formatted_q2,
-                tree1_explanation,
-                tree2_explanation,
-                tree_diff_statement,
-                query_diff_strs, 
-                query_diff_colors
-            ) = self.my_control.generate_differences(query1, query2)
-        except Exception as e:
-            self.explain_A_TextBrowser.setText(e.__class__.__name__ + ':\n' + str(e))
-            self.explain_B_TextBrowser.setText(e.__class__.__name__ + ':\n' + str(e))
-            self.my_control.db.conn.rollback()
-            logging.error(e.__class__.__name__ + ':\n' + str(e))
-            return
-        
-        self.setImgToViewerA("tree1.png")
-        self.setImgToViewerB("tree2.png")
+        # run the comparison on a worker thread so the dialog stays responsive
+        query1, query2 = self.getQueryTexts()
+        self.last_trace = None
+        self.worker_thread = QThread()
+        self.worker = ComparisonWorker(
+            self.my_control,
+            query1,
+            query2,
+            self.analyze_CheckBox.isChecked(),
+            self.timeout_SpinBox.value(),
+            self.renderer,
+        )
+        self.worker.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.onComparisonProgress)
+        self.worker.images.connect(self.onTreeImages)
+        self.worker.drawings.connect(self.onTreeDrawings)
+        self.worker.finished.connect(self.onComparisonFinished)
+        self.worker.failed.connect(self.onComparisonFailed)
+        self.worker.traced.connect(self.onComparisonTraced)
+        self.worker.finished.connect(self.worker_thread.quit)
+        self.worker.failed.connect(self.worker_thread.quit)
+        self.worker_thread.finished.connect(self.onWorkerThreadFinished)
+        self.setRunning(True)
+        self.worker_thread.start()
+
+    def setRunning(self, running: bool):
+        self.getPlan_PushBtn.setEnabled(not running)
+        self.analyze_CheckBox.setEnabled(not running)
+        self.timeout_SpinBox.setEnabled(not running)
+        self.cancel_PushBtn.setEnabled(running)
+        if not running:
+            # the stage times of the last comparison stay in the status area until the next one
+            trace = self.last_trace
+            self.status_label.setText(trace.summary() if trace is not None else "")
+            self.status_label.setToolTip(trace.format() if trace is not None else "")
+
+    def onComparisonTraced(self, trace):
+        self.last_trace = trace
+
+    def onComparisonProgress(self, stage: str):
+        self.status_label.setText(stage_messages.get(stage, stage))
+
+    def onTreeImages(self, tiles1, tiles2):
+        self.imgViewer_A.setTiledImage(tiles1)
+        self.imgViewer_A.show()
+        self.imgViewer_B.setTiledImage(tiles2)
+        self.imgViewer_B.show()
+
+    def onTreeDrawings(self, drawing1: list, drawing2: list):
+        self.imgViewer_A.setPlanTree(drawing1)
+        self.imgViewer_A.show()
+        self.imgViewer_B.setPlanTree(drawing2)
+        self.imgViewer_B.show()
+
+    def onComparisonFinished(self, results: tuple):
+        (
+            formatted_q1,
+            formatted_q2,
+            tree1_explanation,
+            tree2_explanation,
+            tree_diff_statement,
+            query_diff_strs, 
+            query_diff_colors
+        ) = results
         self.setTextResults(
             formatted_QA=formatted_q1,
             formatted_QB=formatted_q2,
@@ -605,8 +842,71 @@ class Ui_Dialog(object):
             query_diff_colors =query_diff_colors
         )
 
+    def onComparisonFailed(self, e: Exception):
+        if isinstance(e, ComparisonCancelled):
+            logging.info("comparison cancelled")
+            self.explain_A_TextBrowser.setText("Cancelled")
+            self.explain_B_TextBrowser.setText("Cancelled")
+            return
+        self.explain_A_TextBrowser.setText(e.__class__.__name__ + ':\n' + str(e))
+        self.explain_B_TextBrowser.setText(e.__class__.__name__ + ':\n' + str(e))
+        logging.error(e.__class__.__name__ + ':\n' + str(e))
+
+    def onWorkerThreadFinished(self):
+        self.worker.deleteLater()
+        self.worker_thread.deleteLater()
+        self.worker = None
+        self.worker_thread = None
+        self.setRunning(False)
+
+    def onDialogClosed(self):
+        # a QThread destroyed while it is running aborts the process,
+        # so the comparison is cancelled and both threads are waited for
+        if self.my_control is not None:
+            self.my_control.cancel()
+        for thread in (self.worker_thread, self.connect_thread):
+            if thread is not None:
+                thread.quit()
+                thread.wait()
+
+    def connectDatabase(self) -> None:
+        self.connect_thread = QThread()
+        self.connect_worker = ConnectionWorker(self.control_args, self.control_options)
+        self.connect_worker.moveToThread(self.connect_thread)
+        self.connect_thread.started.connect(self.connect_worker.run)
+        self.connect_worker.connected.connect(self.onConnected)
+        self.connect_worker.failed.connect(self.onConnectFailed)
+        self.connect_worker.connected.connect(self.connect_thread.quit)
+        self.connect_worker.failed.connect(self.connect_thread.quit)
+        self.connect_thread.finished.connect(self.onConnectThreadFinished)
+        self.getPlan_PushBtn.setEnabled(False)
+        if self.control_options.get("plan_source") is None:
+            self.status_label.setText("Connecting to the database...")
+        self.connect_thread.start()
+
+    def onConnected(self, control):
+        self.my_control = control
+        self.status_label.setText("")
+
+    def onConnectFailed(self, e: Exception):
+        logging.error(e.__class__.__name__ + ':\n' + str(e))
+        self.explain_A_TextBrowser.setText(e.__class__.__name__ + ':\n' + str(e))
+        self.status_label.setText("Could not connect, Get Plan retries")
+
+    def onConnectThreadFinished(self):
+        self.connect_worker.deleteLater()
+        self.connect_thread.deleteLater()
+        self.connect_worker = None
+        self.connect_thread = None
+        self.getPlan_PushBtn.setEnabled(True)
 
     def onClickGetPlanButton(self) -> None:
+        if self.worker_thread is not None or self.connect_thread is not None:
+            return
+        if self.my_control is None:
+            self.clearTextResults()
+            self.connectDatabase()
+            return
         self.imgViewer_A.clearImage()
         self.imgViewer_A.show()
         self.imgViewer_B.clearImage()
@@ -614,7 +914,12 @@ class Ui_Dialog(object):
         self.clearTextResults()
         self.queryResults()
 
-        
+    def onClickCancelButton(self) -> None:
+        if self.worker_thread is None:
+            return
+        self.status_label.setText("Cancelling...")
+        self.cancel_PushBtn.setEnabled(False)
+        self.my_control.cancel()
 
 
 class NoWheelScrollArea(QScrollArea):
@@ -649,6 +954,9 @@ class QtImageViewer(QGraphicsView):
     # Emit index of selected ROI
     roiSelected = pyqtSignal(int)
 
+    # Emitted from a render pool thread when a tile is drawn, with the tile generation, key and future.
+    tileRendered = pyqtSignal(int, object, object)
+
     def __init__(self, *args, **kwargs):
         QGraphicsView.__init__(self, *args, **kwargs)
 
@@ -656,6 +964,26 @@ class QtImageViewer(QGraphicsView):
         self.setScene(self.scene)
 
         self._image = None
+        # edges, nodes and labels of a plan tree drawn by setPlanTree
+        self._treeItems = []
+        # tile pyramid shown by setTiledImage, only the tiles in view are rendered and loaded
+        self._tiles = None
+        # (level, column, row) -> pixmap item, least recently used first
+        self._tileItems = OrderedDict()
+        self._tileRequests = set()
+        # tiles already asked for again after their render worker died, they are not retried twice
+        self._tileRetries = set()
+        # bumped whenever the tiles are cleared so tiles of an earlier tree are dropped
+        self._tileGeneration = 0
+        self.tileCacheSize = 64
+        self.tileRendered.connect(self.onTileRendered)
+        # tiles are looked up once the view settles, fitInView passes through other zooms on the way
+        self.updateTilesTimer = QTimer(self)
+        self.updateTilesTimer.setSingleShot(True)
+        self.updateTilesTimer.setInterval(0)
+        self.updateTilesTimer.timeout.connect(self.updateTiles)
+        self.horizontalScrollBar().valueChanged.connect(lambda value: self.updateTilesTimer.start())
+        self.verticalScrollBar().valueChanged.connect(lambda value: self.updateTilesTimer.start())
 
         self.aspectRatioMode = Qt.AspectRatioMode.KeepAspectRatio
 
@@ -689,20 +1017,30 @@ class QtImageViewer(QGraphicsView):
         return QSize(900, 600)
 
     def hasImage(self):
-        """Returns whether the scene contains an image pixmap."""
-        return self._image is not None
+        """Returns whether the scene contains an image pixmap, a plan tree or tiles."""
+        return self._image is not None or len(self._treeItems) > 0 or self._tiles is not None
 
     def clearImage(self):
-        """Removes the current image pixmap from the scene if it exists."""
-        if self.hasImage():
+        """Removes the current image pixmap, plan tree or tiles from the scene if they exist."""
+        if self._image is not None:
             self.scene.removeItem(self._image)
             self._image = None
+        for item in self._treeItems:
+            self.scene.removeItem(item)
+        self._treeItems = []
+        for item in self._tileItems.values():
+            self.scene.removeItem(item)
+        self._tileItems.clear()
+        self._tileRequests.clear()
+        self._tileRetries.clear()
+        self._tiles = None
+        self._tileGeneration += 1
 
     def pixmap(self):
         """Returns the scene's current image pixmap as a QPixmap, or else None if no image exists.
         :rtype: QPixmap | None
         """
-        if self.hasImage():
+        if self._image is not None:
             return self._image.pixmap()
         return None
 
@@ -710,7 +1048,7 @@ class QtImageViewer(QGraphicsView):
         """Returns the scene's current image pixmap as a QImage, or else None if no image exists.
         :rtype: QImage | None
         """
-        if self.hasImage():
+        if self._image is not None:
             return self._image.pixmap().toImage()
         return None
 
@@ -743,7 +1081,10 @@ class QtImageViewer(QGraphicsView):
             raise RuntimeError(
                 "ImageViewer.setImage: Argument must be a QImage, QPixmap, or numpy.ndarray."
             )
-        if self.hasImage():
+        # a plan tree or tiles shown instead of an image are replaced by it
+        if len(self._treeItems) > 0 or self._tiles is not None:
+            self.clearImage()
+        if self._image is not None:
             self._image.setPixmap(pixmap)
         else:
             self._image = self.scene.addPixmap(pixmap)
@@ -751,6 +1092,126 @@ class QtImageViewer(QGraphicsView):
         self.setSceneRect(QRectF(pixmap.rect()))
         self.updateViewer()
 
+    def setTiledImage(self, tiles):
+        """Show a tile pyramid in place of the current image, tiles are rendered as they come into view.
+        :param tiles: render.TiledTree, e.g. from get_tree_tiles
+        """
+        self.clearImage()
+        self.zoomStack = []
+        self._tiles = tiles
+        # the scene is in full resolution pixels whatever level the tiles are from
+        self.setSceneRect(QRectF(0, 0, tiles.width, tiles.height))
+        self.updateViewer()
+
+    def updateTiles(self):
+        """Request the tiles in view at the current zoom that are not loaded yet."""
+        if self._tiles is None:
+            return
+        tiles = self._tiles
+        # the coarsest level that still has at least one tile pixel per screen pixel
+        scale = self.transform().m11()
+        level = 0 if scale >= 1 else min(int(math.log2(1 / scale)), tiles.levels - 1)
+        visible = (
+            self.mapToScene(self.viewport().rect()).boundingRect().intersected(self.sceneRect())
+        )
+        rect = (visible.x(), visible.y(), visible.width(), visible.height())
+        # the single tile of the last level stays under the others so nothing is blank while they load
+        wanted = [(tiles.levels - 1, 0, 0)]
+        wanted += [(level, column, row) for column, row in tiles.get_tiles(level, rect)]
+        generation = self._tileGeneration
+        for key in wanted:
+            if key in self._tileItems:
+                self._tileItems.move_to_end(key)
+            elif key not in self._tileRequests:
+                self._tileRequests.add(key)
+                future = submit_tile(tiles.get_tile_job(*key))
+                future.add_done_callback(
+                    lambda future, key=key: self.tileRendered.emit(generation, key, future)
+                )
+        self.evictTiles(set(wanted))
+
+    def onTileRendered(self, generation, key, future):
+        if generation != self._tileGeneration:
+            return
+        self._tileRequests.discard(key)
+        try:
+            buffer, width, height = future.result()
+        except BrokenProcessPool as e:
+            # a worker died and the pool was replaced, the tile is asked for once more on the new one
+            logging.error(f"drawing tile {key} failed: the render worker stopped")
+            if key not in self._tileRetries:
+                self._tileRetries.add(key)
+                self.updateTiles()
+            return
+        except Exception as e:
+            logging.error(f"drawing tile {key} failed: {e.__class__.__name__}: {e}")
+            return
+        level, column, row = key
+        image = QImage(buffer, width, height, width * 4, QImage.Format.Format_RGBA8888)
+        item = self.scene.addPixmap(QPixmap.fromImage(image))
+        item.setTransformationMode(Qt.TransformationMode.SmoothTransformation)
+        # placed and scaled in full resolution pixels, finer tiles are drawn over coarser ones
+        scale = 1 << level
+        x, y, _, _ = self._tiles.get_tile_rect(level, column, row)
+        item.setPos(x * scale, y * scale)
+        item.setScale(scale)
+        item.setZValue(-level)
+        self._tileItems[key] = item
+        self.evictTiles({key})
+
+    def evictTiles(self, keep):
+        """Remove the least recently used tiles beyond tileCacheSize, except those in keep."""
+        while len(self._tileItems) > self.tileCacheSize:
+            key = next(iter(self._tileItems))
+            if key in keep:
+                break
+            self.scene.removeItem(self._tileItems.pop(key))
+
+    def setPlanTree(self, drawing, nodeRadius=12.0):
+        """Draw a plan tree as scene items in place of the current image.
+        :param drawing: list of (node id, parent id, x, y, label, colour) from get_tree_drawing
+        """
+        self.clearImage()
+        self.zoomStack = []
+        positions = {node_id: (x, y) for node_id, _, x, y, _, _ in drawing}
+        # cosmetic pens keep their width whatever the zoom
+        edgePen = QPen(QColor("#555555"))
+        edgePen.setCosmetic(True)
+        nodePen = QPen(QColor("#333333"))
+        nodePen.setCosmetic(True)
+        labelFont = QFont()
+        labelFont.setPointSizeF(6)
+        labelBrush = QBrush(QColor("#663300"))
+        # edges first so the nodes are drawn over them
+        for node_id, parent, x, y, _, _ in drawing:
+            if parent == -1:
+                continue
+            parentX, parentY = positions[parent]
+            self._treeItems.append(self.scene.addLine(parentX, parentY, x, y, edgePen))
+        for node_id, parent, x, y, label, colour in drawing:
+            self._treeItems.append(
+                self.scene.addEllipse(
+                    x - nodeRadius,
+                    y - nodeRadius,
+                    2 * nodeRadius,
+                    2 * nodeRadius,
+                    nodePen,
+                    QBrush(QColor(colour)),
+                )
+            )
+            text = QGraphicsSimpleTextItem(label.strip())
+            text.setFont(labelFont)
+            text.setBrush(labelBrush)
+            # centred under the node
+            text.setPos(x - text.boundingRect().width() / 2, y + nodeRadius + 2)
+            self.scene.addItem(text)
+            self._treeItems.append(text)
+        margin = 4 * nodeRadius
+        self.setSceneRect(
+            self.scene.itemsBoundingRect().adjusted(-margin, -margin, margin, margin)
+        )
+        self.updateViewer()
+
     def open(self, filepath=None):
         """Load an image from file.
         Without any arguments, loadImageFromFile() will pop up a file dialog to choose the image file.
@@ -772,6 +1233,8 @@ class QtImageViewer(QGraphicsView):
             )  # Show zoomed rect.
         else:
             self.fitInView(self.sceneRect(), self.aspectRatioMode)  # Show entire image.
+        if self._tiles is not None:
+            self.updateTilesTimer.start()
 
     def clearZoom(self):
         if len(self.zoomStack) > 0:
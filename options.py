@@ -0,0 +1,83 @@
+# The options.py contains the command line options shared by project.py and batch.py
+import argparse
+import os
+
+from explain import PlanStore
+from plan_source import FilePlanSource
+
+connection_arguments = ["host", "port", "database", "user", "password"]
+
+
+# the connection is required unless the plans are read from files with --plan-dir
+def add_connection_arguments(parser: argparse.ArgumentParser) -> None:
+    for name in connection_arguments:
+        parser.add_argument(f"--{name}", type=str, default=None)
+    # compare saved EXPLAIN (FORMAT JSON) files instead of running the queries,
+    # the queries are then file names relative to this directory
+    parser.add_argument("--plan-dir", type=str, default=None)
+
+
+def add_control_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--pool-min", type=int, default=2)
+    parser.add_argument("--pool-max", type=int, default=4)
+    # number of query plans kept in memory, 0 disables the cache
+    parser.add_argument("--plan-cache-size", type=int, default=128)
+    # plans and comparison results are also kept on disk across restarts
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=os.path.join(os.path.expanduser("~"), ".cache", "sql-query-comparison"),
+    )
+    parser.add_argument("--no-disk-cache", action="store_true")
+    parser.add_argument("--cache-ttl-hours", type=float, default=7 * 24)
+    parser.add_argument("--cache-max-mb", type=float, default=256)
+    # use plain EXPLAIN so the queries are planned but not executed
+    parser.add_argument("--estimate-only", action="store_true")
+    # seconds each query may run on the server before it is cancelled
+    parser.add_argument("--statement-timeout", type=float, default=None)
+    # run-time parameter set on every connection, e.g. --session-setting work_mem=64MB
+    parser.add_argument(
+        "--session-setting", type=str, action="append", default=[], metavar="NAME=VALUE"
+    )
+    # log how long each stage of every comparison took, as one JSON line per comparison
+    parser.add_argument("--trace", action="store_true")
+    # also append those lines to this file, implies --trace
+    parser.add_argument("--trace-file", type=str, default=None)
+    # also list the minimum cost edits between the plans, slow on plans of thousands of nodes
+    parser.add_argument("--edit-script", action="store_true")
+
+
+# build the keyword arguments of Control from the parsed command line
+def get_control_options(parser: argparse.ArgumentParser, args: argparse.Namespace) -> dict:
+    session_settings = {}
+    for setting in args.session_setting:
+        name, sep, value = setting.partition("=")
+        if not sep:
+            parser.error(f"--session-setting expects NAME=VALUE, got {setting!r}")
+        session_settings[name.strip()] = value.strip()
+    if args.plan_dir is None:
+        missing = [f"--{name}" for name in connection_arguments if getattr(args, name) is None]
+        if missing:
+            parser.error(f"{', '.join(missing)} required without --plan-dir")
+    control_options = {
+        "min_connections": args.pool_min,
+        "max_connections": args.pool_max,
+        "session_settings": session_settings,
+        "plan_cache_size": args.plan_cache_size,
+        "analyze": not args.estimate_only,
+        "statement_timeout": args.statement_timeout,
+        "tracing": args.trace,
+        "trace_file": args.trace_file,
+        "edit_script": args.edit_script,
+    }
+    if args.plan_dir is not None:
+        if not os.path.isdir(args.plan_dir):
+            parser.error(f"--plan-dir {args.plan_dir} is not a directory")
+        control_options["plan_source"] = FilePlanSource(args.plan_dir)
+    if not args.no_disk_cache:
+        control_options["plan_store"] = PlanStore(
+            os.path.join(args.cache_dir, "plans.sqlite3"),
+            ttl=args.cache_ttl_hours * 3600,
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+        )
+    return control_options
@@ -0,0 +1,61 @@
+# The plan_source.py lets Control compare saved EXPLAIN (FORMAT JSON) output instead of querying a database
+import os
+from abc import ABC, abstractmethod
+
+from tracing import null_trace
+
+
+class PlanSource(ABC):
+    """Where Control gets plans from when it does not run EXPLAIN on a database itself."""
+
+    # names the source in the comparison store, like the server identity of a database
+    identity = None
+
+    # the EXPLAIN (FORMAT json) text of the plan named by query
+    @abstractmethod
+    def fetch_plan(self, query: str, trace=null_trace) -> str:
+        raise NotImplementedError
+
+    # the SQL the plan was made from, to show the query difference, "" when it is not known
+    # tree is the plan as built by get_tree_from_text
+    def get_query(self, query: str, tree) -> str:
+        return ""
+
+    def cancel(self) -> None:
+        pass
+
+
+class FilePlanSource(PlanSource):
+    """Plans saved as EXPLAIN (FORMAT JSON) output or auto_explain JSON, one plan per file.
+
+    A query is the path of a file, relative to root, with or without its .json extension."""
+
+    def __init__(self, root: str = "."):
+        self.root = root
+        self.identity = "files:" + os.path.abspath(root)
+
+    def get_path(self, query: str) -> str:
+        path = os.path.join(self.root, query.strip())
+        if not os.path.isfile(path) and os.path.isfile(path + ".json"):
+            path += ".json"
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"no plan file {path}")
+        return path
+
+    def fetch_plan(self, query: str, trace=null_trace) -> str:
+        path = self.get_path(query)
+        trace.set(source="file", path=path)
+        with trace.span("read"):
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+
+    # the query text auto_explain saves with the plan, otherwise NAME.sql next to NAME.json
+    def get_query(self, query: str, tree) -> str:
+        text = tree.info.get("Query Text")
+        if isinstance(text, str):
+            return text
+        path = os.path.splitext(self.get_path(query))[0] + ".sql"
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        return ""
@@ -0,0 +1,138 @@
+# The plan_tree.py contains the compact in-memory representation of a QEP tree
+from array import array
+
+# we filter out the all not useful attribute in the plan such as Startup Cost, Total Cost, etc.
+useful_attributes = [
+    "Node Type",
+    "Relation Name",
+    "Group Key",
+    "Sort Key",
+    "Sort Method",
+    "Join Type",
+    "Index Name",
+    "Index Cond",
+    "Hash Cond",
+    "Filter",
+    "Merge Cond",
+    "Recheck Cond",
+    "Join Filter",
+    "Partial Mode",
+]
+
+# attributes computed while building the tree, on top of the ones taken from the plan
+derived_attributes = ["Output Relations", "Input Relations", "Category"]
+
+# attribute name -> slot name, e.g. "Node Type" -> "node_type"
+attribute_slots = {
+    name: name.lower().replace(" ", "_") for name in useful_attributes + derived_attributes
+}
+
+
+class PlanNode(object):
+    """A QEP node, read like a dict of its attributes."""
+
+    __slots__ = tuple(attribute_slots.values())
+
+    def __init__(self, **attributes):
+        # plan attributes that are not given are the string "None", as everywhere else
+        for name in useful_attributes:
+            setattr(self, attribute_slots[name], "None")
+        # output relations, order is not considered
+        self.output_relations = set()
+        # input relations, order is considered for join and aggregate
+        self.input_relations = []
+        self.category = "Other"
+        for name, value in attributes.items():
+            self[name] = value
+
+    def __getitem__(self, name: str):
+        try:
+            return getattr(self, attribute_slots[name])
+        except KeyError:
+            raise KeyError(name) from None
+
+    def __setitem__(self, name: str, value) -> None:
+        try:
+            setattr(self, attribute_slots[name], value)
+        except KeyError:
+            raise KeyError(name) from None
+
+    def __contains__(self, name: str) -> bool:
+        return name in attribute_slots
+
+    def __repr__(self) -> str:
+        return f"PlanNode({dict(self.items())!r})"
+
+    def get(self, name: str, default=None):
+        if name in attribute_slots:
+            return self[name]
+        return default
+
+    def keys(self):
+        return attribute_slots.keys()
+
+    def items(self):
+        return [(name, getattr(self, slot)) for name, slot in attribute_slots.items()]
+
+
+class PlanTree(object):
+    """A QEP tree as parallel arrays indexed by node id, ids are given in pre-order from 0."""
+
+    def __init__(self):
+        self.nodes = []
+        # -1 where there is no such node
+        self.parent = array("i")
+        self.first_child = array("i")
+        self.last_child = array("i")
+        self.next_sibling = array("i")
+        # matching with the other tree, set by get_same_pattern, None for unmatched nodes
+        self.pattern_id = []
+        # structural hash and node count of the subtree under each node, see set_subtree_hash
+        self.subtree_hash = []
+        self.subtree_size = array("i")
+        # identical subtrees found by get_same_pattern, as (own root, other root, size)
+        self.shared_subtrees = []
+        # top-level fields of the EXPLAIN output besides the plan, e.g. "Planning Time"
+        self.info = {}
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    # add a node as the last child of parent, or as the root, and return its id
+    def add_node(self, node: PlanNode, parent: int = -1) -> int:
+        node_id = len(self.nodes)
+        self.nodes.append(node)
+        self.parent.append(parent)
+        self.first_child.append(-1)
+        self.last_child.append(-1)
+        self.next_sibling.append(-1)
+        self.pattern_id.append(None)
+        self.subtree_hash.append(None)
+        self.subtree_size.append(1)
+        if parent != -1:
+            if self.first_child[parent] == -1:
+                self.first_child[parent] = node_id
+            else:
+                self.next_sibling[self.last_child[parent]] = node_id
+            self.last_child[parent] = node_id
+        return node_id
+
+    # children of a node in plan order
+    def successors(self, node_id: int):
+        child_id = self.first_child[node_id]
+        while child_id != -1:
+            yield child_id
+            child_id = self.next_sibling[child_id]
+
+    # networkx copy of the tree, only built when something needs networkx, which is only imported then
+    def to_networkx(self):
+        import networkx as nx
+
+        graph = nx.DiGraph()
+        for node_id, node in enumerate(self.nodes):
+            graph.add_node(node_id, **dict(node.items()))
+            if self.pattern_id[node_id] is not None:
+                graph.nodes[node_id]["pattern_id"] = self.pattern_id[node_id]
+            if self.parent[node_id] != -1:
+                graph.add_edge(self.parent[node_id], node_id)
+        return graph
@@ -1,27 +1,51 @@
 # The project.py is the main file that invokes all the necessary procedures
 import sys
 from interface import Ui_Dialog
+from options import add_connection_arguments, add_control_arguments, get_control_options
 from PyQt6.QtWidgets import QApplication, QDialog
 import logging
 import argparse
 
-if __name__ == "__main__":
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        handlers=[logging.StreamHandler()],
-    )
+
+def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
-    parser.add_argument("--host", type=str, required=True)
-    parser.add_argument("--port", type=str, required=True)
-    parser.add_argument("--database", type=str, required=True)
-    parser.add_argument("--user", type=str, required=True)
-    parser.add_argument("--password", type=str, required=True)
-    args = parser.parse_args()
+    add_connection_arguments(parser)
+    add_control_arguments(parser)
+    parser.add_argument(
+        "--renderer",
+        choices=["matplotlib", "qt"],
+        default="matplotlib",
+        help="draw the QEP trees as images with matplotlib, or directly as Qt scene items",
+    )
+    return parser
+
+
+# everything done before the event loop starts, benchmark/startup.py times this as well
+def show_dialog(argv: list = None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    control_options = get_control_options(parser, args)
     app = QApplication(sys.argv)
     Dialog = QDialog()
     ui = Ui_Dialog(
-        Dialog, args.host, args.port, args.database, args.user, args.password
+        Dialog,
+        args.host,
+        args.port,
+        args.database,
+        args.user,
+        args.password,
+        control_options=control_options,
+        renderer=args.renderer,
     )
     Dialog.show()
+    return app, Dialog, ui
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler()],
+    )
+    app, Dialog, ui = show_dialog()
     sys.exit(app.exec())
@@ -0,0 +1,332 @@
+# The render.py draws QEP trees with matplotlib in a pool of worker processes
+import math
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# matplotlib and networkx are imported by the functions that draw, so importing this module is cheap
+# and they are only loaded by the worker processes and once the first tree is laid out
+
+# one worker per tree so both trees of a comparison are drawn at the same time,
+# 0 draws the trees one after another in the calling process instead
+render_workers = 2
+
+# the pool is shared by every comparison in the process and its workers stay up between them
+render_pool = None
+render_pool_lock = threading.Lock()
+
+# node markers in points^2 and labels in points, as in every drawing of a tree
+NODE_SIZE = 200
+NODE_LINE_WIDTH = 2
+LABEL_FONT_SIZE = 3
+LABEL_COLOR = "#663300"
+# tiles are square, in pixels
+TILE_SIZE = 512
+# tiles where the label text would be smaller than this many pixels are drawn without labels
+MIN_LABEL_PIXELS = 2
+
+
+# draw one tree, run in a worker process
+# the figure is built with the object-oriented API so no pyplot state is involved
+# the figure is saved to filename as a png file
+def render_tree(
+    pos: dict, labels: dict, colors: list, edges: list, figsize: tuple, dpi: int, filename: str
+) -> None:
+    import networkx as nx
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    # undirected as we don't need to draw the direction of the edges
+    graph = nx.Graph()
+    graph.add_nodes_from(range(len(colors)))
+    graph.add_edges_from(edges)
+    nx.draw_networkx(
+        graph,
+        pos=pos,
+        ax=ax,
+        node_shape="o",
+        node_size=NODE_SIZE,
+        node_color=colors,
+        linewidths=NODE_LINE_WIDTH,
+        with_labels=False,
+    )
+    nx.draw_networkx_labels(
+        graph, pos=pos, labels=labels, font_size=LABEL_FONT_SIZE, font_color=LABEL_COLOR, ax=ax
+    )
+    ax.axis("off")
+    fig.savefig(filename, dpi=dpi)
+
+
+# draw one tile of a TiledTree, run in a worker process
+# only the nodes and edges reaching into the tile are given, the axes are placed and scaled
+# as in the figure of the whole tree so the tiles fit together
+def render_tile(
+    pos: dict,
+    labels: dict,
+    nodes: list,
+    colors: list,
+    edges: list,
+    limits: tuple,
+    axes_position: tuple,
+    figsize: tuple,
+    dpi: float,
+):
+    import networkx as nx
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes(axes_position)
+    graph = nx.Graph()
+    graph.add_nodes_from(pos)
+    graph.add_edges_from(edges)
+    if edges:
+        nx.draw_networkx_edges(graph, pos=pos, edgelist=edges, ax=ax)
+    if nodes:
+        nx.draw_networkx_nodes(
+            graph,
+            pos=pos,
+            nodelist=nodes,
+            ax=ax,
+            node_shape="o",
+            node_size=NODE_SIZE,
+            node_color=colors,
+            linewidths=NODE_LINE_WIDTH,
+        )
+        nx.draw_networkx_labels(
+            graph, pos=pos, labels=labels, font_size=LABEL_FONT_SIZE, font_color=LABEL_COLOR, ax=ax
+        )
+    # set last, the networkx functions rescale the axes to what they have drawn
+    ax.set_xlim(limits[0])
+    ax.set_ylim(limits[1])
+    ax.axis("off")
+    canvas.draw()
+    buffer = canvas.buffer_rgba()
+    return bytes(buffer), buffer.shape[1], buffer.shape[0]
+
+
+# data limits of one axis as render_tree ends up with for the whole tree
+# networkx pads the extent of the edges by 5%, then matplotlib widens a single value and adds its margin
+def get_limits(values: list, margin: float, has_edges: bool) -> tuple[float, float]:
+    from matplotlib.transforms import nonsingular
+
+    low, high = min(values), max(values)
+    if has_edges:
+        pad = (high - low) * 0.05
+        low, high = low - pad, high + pad
+    low, high = nonsingular(low, high, expander=0.05)
+    pad = (high - low) * margin
+    return low - pad, high + pad
+
+
+class TiledTree(object):
+    """A tree drawing cut into square tiles at several resolutions, tiles are rendered on request."""
+
+    def __init__(
+        self, pos: dict, labels: dict, colors: list, edges: list, figsize: tuple, dpi: int
+    ):
+        import matplotlib
+
+        self.pos = pos
+        self.labels = labels
+        self.colors = colors
+        self.edges = edges
+        self.dpi = dpi
+        # the whole figure in pixels at level 0, the full resolution
+        self.width = max(int(figsize[0] * dpi), 1)
+        self.height = max(int(figsize[1] * dpi), 1)
+        # every level halves the resolution of the one before, the last fits in a single tile
+        self.levels = 1
+        while max(self.width, self.height) > TILE_SIZE << (self.levels - 1):
+            self.levels += 1
+        xs = [x for x, _ in pos.values()]
+        ys = [y for _, y in pos.values()]
+        params = matplotlib.rcParams
+        self.limits = (
+            get_limits(xs, params["axes.xmargin"], len(edges) > 0),
+            get_limits(ys, params["axes.ymargin"], len(edges) > 0),
+        )
+        # the axes of the whole figure in level 0 pixels, (left, bottom, width, height) from the bottom left
+        left, right = params["figure.subplot.left"], params["figure.subplot.right"]
+        bottom, top = params["figure.subplot.bottom"], params["figure.subplot.top"]
+        self.axes_rect = (
+            left * self.width,
+            bottom * self.height,
+            (right - left) * self.width,
+            (top - bottom) * self.height,
+        )
+        # where each node is and how far its marker and label reach around it, in level 0 pixels from the top
+        points = dpi / 72
+        marker_reach = (math.sqrt(NODE_SIZE) / 2 + NODE_LINE_WIDTH) * points
+        self.node_boxes = {}
+        for node_id, (x, y) in pos.items():
+            px, py = self.get_pixel(x, y)
+            lines = labels.get(node_id, "").split("\n")
+            # a generous 0.7 em per character so no label is cut at a tile border
+            reach_x = max(marker_reach, max(len(line) for line in lines) * 0.7 * LABEL_FONT_SIZE / 2 * points)
+            reach_y = max(marker_reach, len(lines) * 1.2 * LABEL_FONT_SIZE / 2 * points)
+            self.node_boxes[node_id] = (px - reach_x, py - reach_y, px + reach_x, py + reach_y)
+        self.edge_boxes = []
+        for parent, child in edges:
+            (px, py), (cx, cy) = self.get_pixel(*pos[parent]), self.get_pixel(*pos[child])
+            self.edge_boxes.append((min(px, cx), min(py, cy), max(px, cx), max(py, cy)))
+
+    # level 0 pixel of a point of the layout, counted from the top left like the Qt scene
+    def get_pixel(self, x: float, y: float) -> tuple[float, float]:
+        (xmin, xmax), (ymin, ymax) = self.limits
+        left, bottom, width, height = self.axes_rect
+        px = left + (x - xmin) / (xmax - xmin) * width
+        py = self.height - (bottom + (y - ymin) / (ymax - ymin) * height)
+        return px, py
+
+    def get_level_size(self, level: int) -> tuple[int, int]:
+        return -(-self.width >> level), -(-self.height >> level)
+
+    # the (column, row) of every tile of the level that overlaps rect, given as (x, y, width, height) in level 0 pixels
+    def get_tiles(self, level: int, rect: tuple) -> list[tuple[int, int]]:
+        width, height = self.get_level_size(level)
+        columns, rows = -(-width // TILE_SIZE), -(-height // TILE_SIZE)
+        span = TILE_SIZE << level
+        x, y, w, h = rect
+        first_column, last_column = max(int(x // span), 0), min(int((x + w) // span), columns - 1)
+        first_row, last_row = max(int(y // span), 0), min(int((y + h) // span), rows - 1)
+        return [
+            (column, row)
+            for row in range(first_row, last_row + 1)
+            for column in range(first_column, last_column + 1)
+        ]
+
+    # the tile in pixels of its level, as (x, y, width, height) from the top left
+    def get_tile_rect(self, level: int, column: int, row: int) -> tuple[int, int, int, int]:
+        width, height = self.get_level_size(level)
+        x, y = column * TILE_SIZE, row * TILE_SIZE
+        return x, y, min(TILE_SIZE, width - x), min(TILE_SIZE, height - y)
+
+    # the arguments of render_tile for one tile
+    def get_tile_job(self, level: int, column: int, row: int) -> tuple:
+        x, y, w, h = self.get_tile_rect(level, column, row)
+        scale = 1 << level
+        # the tile in level 0 pixels, widened by a point for the edge line width
+        pad = self.dpi / 72
+        x0, y0 = x * scale - pad, y * scale - pad
+        x1, y1 = (x + w) * scale + pad, (y + h) * scale + pad
+        nodes = [
+            node_id
+            for node_id, (left, top, right, bottom) in self.node_boxes.items()
+            if left < x1 and right > x0 and top < y1 and bottom > y0
+        ]
+        edges = [
+            edge
+            for edge, (left, top, right, bottom) in zip(self.edges, self.edge_boxes)
+            if left < x1 and right > x0 and top < y1 and bottom > y0
+        ]
+        used = set(nodes)
+        for edge in edges:
+            used.update(edge)
+        pos = {node_id: self.pos[node_id] for node_id in used}
+        colors = [self.colors[node_id] for node_id in nodes]
+        dpi = self.dpi / scale
+        # labels too small to read are left out, drawing text is most of the time of a tile
+        labels = {}
+        if LABEL_FONT_SIZE * dpi / 72 >= MIN_LABEL_PIXELS:
+            labels = {node_id: self.labels[node_id] for node_id in nodes}
+        # the axes of the whole figure at this level, relative to the tile
+        left, bottom, width, height = (value / scale for value in self.axes_rect)
+        tile_bottom = self.get_level_size(level)[1] - (y + h)
+        axes_position = ((left - x) / w, (bottom - tile_bottom) / h, width / w, height / h)
+        # a quarter pixel over so the canvas is not rounded down a pixel
+        figsize = ((w + 0.25) / dpi, (h + 0.25) / dpi)
+        return pos, labels, nodes, colors, edges, self.limits, axes_position, figsize, dpi
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global render_pool
+    with render_pool_lock:
+        if render_pool is None:
+            # spawn, forking a process that runs Qt or other threads is not safe
+            # every worker loads the renderer as it starts, before it takes its first job
+            render_pool = ProcessPoolExecutor(
+                max_workers=render_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=load_renderer,
+            )
+        return render_pool
+
+
+# load what render_tree and render_tile need, run by each worker as it starts
+def load_renderer() -> None:
+    import matplotlib.backends.backend_agg
+    import matplotlib.figure
+    import networkx
+
+
+# do nothing, submitted to make the pool start a worker
+def start_worker() -> None:
+    pass
+
+
+# start the workers ahead of time so the first comparison does not wait for matplotlib to load
+# the pool starts a new worker for each job submitted while none is idle, up to render_workers,
+# and each worker loads the renderer in its initializer, so no job can take a worker that is not warm
+def start_render_pool() -> None:
+    if render_workers == 0:
+        return
+    pool = get_render_pool()
+    for _ in range(render_workers):
+        pool.submit(start_worker)
+
+
+# forget a pool whose worker died, e.g. out of memory on a huge plan, the next call starts a new one
+def reset_render_pool(pool: ProcessPoolExecutor) -> None:
+    global render_pool
+    with render_pool_lock:
+        if render_pool is pool:
+            render_pool = None
+
+
+# forget the pool as soon as one of its jobs finds it broken, run when a job is done
+def reset_if_broken(pool: ProcessPoolExecutor, future: Future) -> None:
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        reset_render_pool(pool)
+
+
+# draw several trees at once, jobs are the arguments of render_tree, returns once every file is saved
+def render_trees(jobs: list) -> None:
+    if render_workers == 0:
+        for job in jobs:
+            render_tree(*job)
+        return
+    pool = get_render_pool()
+    futures = [pool.submit(render_tree, *job) for job in jobs]
+    try:
+        for future in futures:
+            future.result()
+    except BrokenProcessPool:
+        reset_render_pool(pool)
+        raise
+
+
+# start drawing one tile, job is from TiledTree.get_tile_job, the future gives (bytes, width, height)
+def submit_tile(job: tuple) -> Future:
+    if render_workers == 0:
+        future = Future()
+        try:
+            future.set_result(render_tile(*job))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    pool = get_render_pool()
+    try:
+        future = pool.submit(render_tile, *job)
+    except BrokenProcessPool:
+        reset_render_pool(pool)
+        pool = get_render_pool()
+        future = pool.submit(render_tile, *job)
+    # a tile that kills its worker fails with BrokenProcessPool, the tiles asked for after it get a new pool
+    future.add_done_callback(lambda future: reset_if_broken(pool, future))
+    return future
@@ -0,0 +1,201 @@
+# The tracing.py times the stages of a comparison as nested spans
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+# one JSON line per comparison is logged under this name
+logger_name = "trace"
+
+
+class Span(object):
+    """A timed stage of a comparison, inside the stage it was started in."""
+
+    __slots__ = ("name", "parent", "start", "end", "thread", "attributes")
+
+    def __init__(self, name: str, parent, attributes: dict):
+        self.name = name
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end = None
+        self.thread = threading.current_thread().name
+        self.attributes = attributes
+
+    # seconds the span took, or has taken so far
+    @property
+    def duration(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+
+class SpanContext(object):
+    """Opens a span of a trace on enter and closes it on exit, an exception is recorded on the span."""
+
+    __slots__ = ("trace", "span")
+
+    def __init__(self, trace, span: Span):
+        self.trace = trace
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self.trace.get_stack().append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.span.end = time.perf_counter()
+        if exc_type is not None:
+            self.span.attributes["error"] = exc_type.__name__
+        self.trace.get_stack().pop()
+
+
+class Trace(object):
+    """The spans of one comparison, spans are nested under the open span of the same thread."""
+
+    enabled = True
+
+    def __init__(self, name: str = "comparison", **attributes):
+        self.started = time.time()
+        self.local = threading.local()
+        self.root = Span(name, None, attributes)
+        # every span in the order they were started, appending is safe from several threads
+        self.spans = [self.root]
+
+    # the open spans of the calling thread, innermost last
+    def get_stack(self) -> list:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def current(self) -> Span:
+        stack = self.get_stack()
+        return stack[-1] if stack else self.root
+
+    # a span to be used with with, under parent or else the open span of this thread
+    # parent is given for work handed to another thread
+    def span(self, name: str, parent: Span = None, **attributes) -> SpanContext:
+        span = Span(name, parent or self.current(), attributes)
+        self.spans.append(span)
+        return SpanContext(self, span)
+
+    # add attributes to the open span of this thread
+    def set(self, **attributes) -> None:
+        self.current().attributes.update(attributes)
+
+    # the first span with the name, inside a span named parent if given
+    def find(self, name: str, parent: str = None) -> Span:
+        for span in self.spans:
+            if span.name == name and (
+                parent is None or span.parent is not None and span.parent.name == parent
+            ):
+                return span
+        return None
+
+    def finish(self) -> None:
+        if self.root.end is None:
+            self.root.end = time.perf_counter()
+
+    # the trace as plain data, spans start in seconds from the start of the trace and point to their parent's index
+    def to_dict(self) -> dict:
+        index = {id(span): n for n, span in enumerate(self.spans)}
+        spans = []
+        for span in self.spans:
+            entry = {
+                "name": span.name,
+                "parent": index[id(span.parent)] if span.parent is not None else None,
+                "start": round(span.start - self.root.start, 6),
+                "duration": round(span.duration, 6),
+                "thread": span.thread,
+            }
+            entry.update(span.attributes)
+            spans.append(entry)
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "duration": round(self.root.duration, 6),
+            "spans": spans,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), default=str)
+
+    # one line with the time of each top level stage, e.g. for a status bar
+    def summary(self) -> str:
+        parts = []
+        for span in self.spans:
+            if span.parent is not self.root:
+                continue
+            part = f"{span.name} {format_seconds(span.duration)}"
+            server_time = sum(
+                inner.attributes.get("server_time", 0.0)
+                for inner in self.spans
+                if is_inside(inner, span)
+            )
+            if server_time:
+                part += f" (server {format_seconds(server_time)})"
+            parts.append(part)
+        parts.append(f"total {format_seconds(self.root.duration)}")
+        return ", ".join(parts)
+
+    # every span on its own line, indented under its parent
+    def format(self) -> str:
+        children = {}
+        for span in self.spans[1:]:
+            children.setdefault(id(span.parent), []).append(span)
+        lines = []
+        stack = [(self.root, 0)]
+        while stack:
+            span, depth = stack.pop()
+            attributes = "".join(
+                f" {key}={format_seconds(value)}" if isinstance(value, float) else f" {key}={value}"
+                for key, value in span.attributes.items()
+            )
+            lines.append(f"{'  ' * depth}{span.name} {format_seconds(span.duration)}{attributes}")
+            stack.extend((child, depth + 1) for child in reversed(children.get(id(span), [])))
+        return "\n".join(lines)
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    return f"{seconds:.2f}s"
+
+
+def is_inside(span: Span, outer: Span) -> bool:
+    while span.parent is not None:
+        if span.parent is outer:
+            return True
+        span = span.parent
+    return False
+
+
+class NullTrace(object):
+    """Stands in for a Trace when tracing is off, nothing is timed or kept."""
+
+    enabled = False
+
+    def __init__(self):
+        self.context = nullcontext()
+
+    def span(self, name: str, parent: Span = None, **attributes):
+        return self.context
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def current(self) -> Span:
+        return None
+
+    def find(self, name: str, parent: str = None) -> Span:
+        return None
+
+    def finish(self) -> None:
+        pass
+
+
+null_trace = NullTrace()
+
+
+# append a trace to a file as one JSON line, lines are written whole so several processes can share the file
+def write_trace(trace: Trace, path: str) -> None:
+    with open(path, "a") as f:
+        f.write(trace.to_json() + "\n")
@@ -0,0 +1,239 @@
+# The tree_edit.py computes the ordered tree edit distance between two QEP trees (Zhang-Shasha)
+import numpy as np
+
+from plan_tree import PlanTree
+
+DELETE_COST = 1.0
+INSERT_COST = 1.0
+# changing the attributes of a node costs less than changing what kind of node it is
+ATTRIBUTE_COST = 0.5
+NODE_TYPE_COST = 1.0
+# keyroot pairs with a subtree at least this large are computed a row at a time with numpy
+VECTOR_MIN_SIZE = 64
+
+
+class PostorderTree(object):
+    """A QEP tree flattened into post-order arrays."""
+
+    def __init__(self, tree: PlanTree, get_key, keys: dict):
+        # node ids in post-order, built without recursion so deep plans are fine
+        self.nodes = []
+        stack = [(0, False)]
+        while stack:
+            node_id, visited = stack.pop()
+            if visited:
+                self.nodes.append(node_id)
+                continue
+            stack.append((node_id, True))
+            for child_id in reversed(list(tree.successors(node_id))):
+                stack.append((child_id, False))
+        index = {node_id: i for i, node_id in enumerate(self.nodes)}
+        # the post-order index of the leftmost leaf under each node
+        self.leftmost = []
+        for i, node_id in enumerate(self.nodes):
+            children = list(tree.successors(node_id))
+            self.leftmost.append(self.leftmost[index[children[0]]] if children else i)
+        # keyroots are the highest nodes for each leftmost leaf, i.e. the root and every node with a left sibling
+        highest = {}
+        for i, leftmost in enumerate(self.leftmost):
+            highest[leftmost] = i
+        self.keyroots = sorted(highest.values())
+        # equal nodes share a key, so comparing two nodes is an int comparison
+        self.keys = [
+            keys.setdefault(get_key(tree.nodes[node_id]), len(keys))
+            for node_id in self.nodes
+        ]
+        self.node_types = [tree.nodes[node_id]["Node Type"] for node_id in self.nodes]
+        # the same as numpy arrays for the row at a time computation
+        self.leftmost_array = np.array(self.leftmost)
+        self.keys_array = np.array(self.keys)
+        self.node_types_array = np.array(self.node_types, dtype=object)
+
+
+class TreeEditDistance(object):
+    """Minimum cost edit script between two QEP trees."""
+
+    def __init__(self, tree1: PlanTree, tree2: PlanTree, get_key):
+        keys = {}
+        self.t1 = PostorderTree(tree1, get_key, keys)
+        self.t2 = PostorderTree(tree2, get_key, keys)
+        # distance between every pair of subtrees, filled keyroot pair by keyroot pair
+        # costs are multiples of 0.5 so float32 is exact and halves the memory
+        self.treedist = np.zeros((len(self.t1.nodes), len(self.t2.nodes)), dtype=np.float32)
+        self.treedist_rows = [memoryview(row) for row in self.treedist]
+        for i in self.t1.keyroots:
+            for j in self.t2.keyroots:
+                self.forest_distance(i, j)
+
+    @property
+    def distance(self) -> float:
+        return float(self.treedist[-1, -1])
+
+    def rename_cost(self, i: int, j: int) -> float:
+        if self.t1.keys[i] == self.t2.keys[j]:
+            return 0.0
+        if self.t1.node_types[i] == self.t2.node_types[j]:
+            return ATTRIBUTE_COST
+        return NODE_TYPE_COST
+
+    # distance between the forests under subtrees i and j, also fills treedist for the subtree pairs on the left paths
+    # fd[x][y] is the distance between the first x nodes under i and the first y nodes under j in post-order
+    def forest_distance(self, i: int, j: int):
+        size1, size2 = i - self.t1.leftmost[i] + 1, j - self.t2.leftmost[j] + 1
+        # numpy only pays off on long rows, most keyroot pairs of a plan are small
+        if max(size1, size2) < VECTOR_MIN_SIZE:
+            return self.small_forest_distance(i, j)
+        # one forest is walked node by node and the other is handled a whole row at a time,
+        # so the shorter one is walked
+        if size1 <= size2:
+            return get_forest_distance(
+                self.t1, self.t2, i, j, self.treedist, DELETE_COST, INSERT_COST
+            )
+        return get_forest_distance(
+            self.t2, self.t1, j, i, self.treedist.T, INSERT_COST, DELETE_COST
+        ).T
+
+    # the same as get_forest_distance with plain lists, for the many small keyroot pairs
+    def small_forest_distance(self, i: int, j: int) -> list[list[float]]:
+        t1, t2 = self.t1, self.t2
+        leftmost1, leftmost2 = t1.leftmost, t2.leftmost
+        keys1, keys2 = t1.keys, t2.keys
+        node_types1, node_types2 = t1.node_types, t2.node_types
+        l1, l2 = leftmost1[i], leftmost2[j]
+        rows, cols = i - l1 + 2, j - l2 + 2
+        fd = [[y * INSERT_COST for y in range(cols)]]
+        for x in range(1, rows):
+            fd.append([x * DELETE_COST] + [0.0] * (cols - 1))
+        for x in range(1, rows):
+            i1 = l1 + x - 1
+            row, prev = fd[x], fd[x - 1]
+            # a memoryview reads and writes the numpy row as plain floats
+            td_row = self.treedist_rows[i1]
+            aligned1 = leftmost1[i1] == l1
+            sub_row = fd[leftmost1[i1] - l1]
+            for y in range(1, cols):
+                j1 = l2 + y - 1
+                cost = prev[y] + DELETE_COST
+                other = row[y - 1] + INSERT_COST
+                if other < cost:
+                    cost = other
+                if aligned1 and leftmost2[j1] == l2:
+                    # both are whole trees, so this is the distance between the two subtrees
+                    if keys1[i1] == keys2[j1]:
+                        other = prev[y - 1]
+                    elif node_types1[i1] == node_types2[j1]:
+                        other = prev[y - 1] + ATTRIBUTE_COST
+                    else:
+                        other = prev[y - 1] + NODE_TYPE_COST
+                    if other < cost:
+                        cost = other
+                    td_row[j1] = cost
+                else:
+                    other = sub_row[leftmost2[j1] - l2] + td_row[j1]
+                    if other < cost:
+                        cost = other
+                row[y] = cost
+        return fd
+
+    # walk back through the forest distances and collect the operations, returned with the tree node ids
+    def edit_script(self) -> list[tuple]:
+        t1, t2 = self.t1, self.t2
+        script = []
+        pending = [(len(t1.nodes) - 1, len(t2.nodes) - 1)]
+        while pending:
+            i, j = pending.pop()
+            fd = self.forest_distance(i, j)
+            if isinstance(fd, np.ndarray):
+                fd = fd.tolist()
+            l1, l2 = t1.leftmost[i], t2.leftmost[j]
+            x, y = i - l1 + 1, j - l2 + 1
+            while x > 0 or y > 0:
+                i1, j1 = l1 + x - 1, l2 + y - 1
+                if x > 0 and y > 0:
+                    if t1.leftmost[i1] == l1 and t2.leftmost[j1] == l2:
+                        cost = self.rename_cost(i1, j1)
+                        if fd[x][y] == fd[x - 1][y - 1] + cost:
+                            op = "match" if cost == 0 else "rename"
+                            script.append((op, t1.nodes[i1], t2.nodes[j1]))
+                            x, y = x - 1, y - 1
+                            continue
+                    elif fd[x][y] == (
+                        fd[t1.leftmost[i1] - l1][t2.leftmost[j1] - l2] + self.treedist[i1, j1]
+                    ):
+                        # the subtrees under i1 and j1 are matched with each other, expand them later
+                        pending.append((i1, j1))
+                        x, y = t1.leftmost[i1] - l1, t2.leftmost[j1] - l2
+                        continue
+                if x > 0 and fd[x][y] == fd[x - 1][y] + DELETE_COST:
+                    script.append(("delete", t1.nodes[i1], None))
+                    x -= 1
+                else:
+                    script.append(("insert", None, t2.nodes[j1]))
+                    y -= 1
+        script.sort(
+            key=lambda op: (
+                op[1] if op[1] is not None else -1,
+                op[2] if op[2] is not None else -1,
+            )
+        )
+        return script
+
+
+# forest distance between subtree i of a and subtree j of b, a row for each node under i
+# treedist is indexed [node of a, node of b], it is the transposed view when a is the second tree
+def get_forest_distance(
+    a: PostorderTree,
+    b: PostorderTree,
+    i: int,
+    j: int,
+    treedist: np.ndarray,
+    delete_cost: float,
+    insert_cost: float,
+) -> np.ndarray:
+    la, lb = a.leftmost[i], b.leftmost[j]
+    rows, cols = i - la + 2, j - lb + 2
+    fd = np.empty((rows, cols), dtype=np.float32)
+    fd[0] = np.arange(cols) * insert_cost
+    fd[:, 0] = np.arange(rows) * delete_cost
+    columns = slice(lb, j + 1)
+    # columns where the node of b is a whole tree in this forest, and where each column's subtree starts
+    aligned_b = b.leftmost_array[columns] == lb
+    subtree_start_b = b.leftmost_array[columns] - lb
+    keys_b = b.keys_array[columns]
+    node_types_b = b.node_types_array[columns]
+    # row[y] = min(c[y], row[y - 1] + insert_cost) is a running minimum once the slope is taken out
+    slope = np.arange(cols) * insert_cost
+    for x in range(1, rows):
+        ia = la + x - 1
+        prev = fd[x - 1]
+        cost = prev[1:] + delete_cost
+        if a.leftmost[ia] == la:
+            rename = np.where(
+                keys_b == a.keys[ia],
+                0.0,
+                np.where(node_types_b == a.node_types[ia], ATTRIBUTE_COST, NODE_TYPE_COST),
+            )
+            other = np.where(
+                aligned_b,
+                prev[:-1] + rename,
+                fd[0, subtree_start_b] + treedist[ia, columns],
+            )
+        else:
+            other = fd[a.leftmost[ia] - la, subtree_start_b] + treedist[ia, columns]
+        np.minimum(cost, other, out=cost)
+        row = fd[x]
+        row[1:] = cost
+        row -= slope
+        np.minimum.accumulate(row, out=row)
+        row += slope
+        if a.leftmost[ia] == la:
+            # both are whole trees, so this is the distance between the two subtrees
+            treedist[ia, columns][aligned_b] = row[1:][aligned_b]
+    return fd
+
+
+# minimum cost edit script turning tree1 into tree2 and its cost
+# get_key maps a node to a hashable value that is equal exactly when the nodes are
+def get_edit_script(tree1: PlanTree, tree2: PlanTree, get_key) -> tuple[float, list[tuple]]:
+    ted = TreeEditDistance(tree1, tree2, get_key)
+    return ted.distance, ted.edit_script()